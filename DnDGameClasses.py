@@ -1,4 +1,5 @@
-from langchain_community.chat_models import ChatOllama
+from functools import lru_cache
+
 from langchain_community.llms.gpt4all import GPT4All
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import (
@@ -7,33 +8,61 @@ from langchain_core.prompts import (
     HumanMessagePromptTemplate,
     MessagesPlaceholder,
 )
-from langchain_core.messages import SystemMessage
-from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain.chains import LLMChain
 
+from game_memory import RollingSummaryMemory
+from llm_backends import create_llm
 
-class DnDGameMaster:
-    def __init__(self):
-        self.state = "world_selection"  # initial state
-        self.world_setting = None
-        self.world_settings = {
-            1: "The Shattered Isles: A realm of floating islands and sky pirates.",
-            2: "The Verdant Expanse: A dense jungle world teeming with life and peril.",
-            3: "The Frozen Wastes: A land of ice, snow, and forgotten magic.",
-        }
+WORLD_SETTINGS = {
+    1: "The Shattered Isles: A realm of floating islands and sky pirates.",
+    2: "The Verdant Expanse: A dense jungle world teeming with life and peril.",
+    3: "The Frozen Wastes: A land of ice, snow, and forgotten magic.",
+}
 
-        self.llm = ChatOllama(model="llama2")
-        # self.llm = GPT4All(
-        #     model="/Users/kohjunkai/Library/Application Support/nomic.ai/GPT4All/"
-        # )
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True
-        )
-        self.prompt_template = ChatPromptTemplate.from_messages(
+# Background art for each world, in the generate_background.py format
+# name: [positive prompt, negative prompt]
+WORLD_BACKGROUNDS = {
+    1: {"shattered_isles": ["floating islands in the sky, sky pirate airships, clouds and waterfalls", "person"]},
+    2: {"verdant_expanse": ["dense jungle teeming with life, giant trees, vines and ancient ruins", "person"]},
+    3: {"frozen_wastes": ["frozen wasteland of ice and snow, forgotten ruins glowing with magic", "person"]},
+}
+
+# Every prompt starts with the same messages so that consecutive turns share a byte-identical
+# prefix and Ollama can reuse its KV cache for it instead of re-running the prefill.
+SYSTEM_PROMPT = "You are a Game Master of a Dungeons and Dragons Quest. You create beautiful and immersive worlds for your players to explore."
+WELCOME_MESSAGE = "Welcome to AI Dungeons & Dragons! Please choose a world setting for your DnD quest: 1. The Shattered Isles 2. Jungle World 3. The Frozen Wastes"
+
+# Instruction appended after the conversation for each game state
+STATE_INSTRUCTIONS = {
+    "world_selection": "Please generate 3 character options for the player to choose from. keep the details breif and short.",
+    "scenario_narration": "Please continue to narrate the DnD story based on the chosen settings, player character choice and the subsequent action choices.",
+}
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Forwards every token produced by the chat model to a callback as soon as it arrives.
+    """
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.on_token(token)
+
+
+@lru_cache(maxsize=None)
+def build_prompt(state, world_choice):
+    """
+    Returns the prompt template for a (state, world) pair. Templates are immutable, so
+    they are built once per process and shared by every game master.
+    """
+    if world_choice is None:
+        return ChatPromptTemplate.from_messages(
             [
-                SystemMessage(
-                    content="You are a Game Master of a Dungeons and Dragons Quest. You create beautiful and immersive worlds for your players to explore."
-                ),  # The persistent system prompt
+                SystemMessage(content=SYSTEM_PROMPT),  # The persistent system prompt
                 MessagesPlaceholder(
                     variable_name="chat_history"
                 ),  # Where the memory will be stored.
@@ -42,98 +71,203 @@ class DnDGameMaster:
                 ),  # Where the human input will injected
             ]
         )
-        self.chain = LLMChain(
-            llm=self.llm,
-            memory=self.memory,
-            verbose=True,
-            prompt=self.prompt_template,
+
+    messages = [
+        SystemMessage(content=SYSTEM_PROMPT),
+        AIMessagePromptTemplate.from_template(WELCOME_MESSAGE),
+        HumanMessage(
+            content=f"Your choice: {world_choice} - {WORLD_SETTINGS[world_choice]}"
+        ),
+        MessagesPlaceholder(variable_name="chat_history"),
+    ]
+    if state != "world_selection":
+        # The world choice itself is already part of the prefix above
+        messages.append(HumanMessagePromptTemplate.from_template("{user_input}"))
+    messages.append(SystemMessage(content=STATE_INSTRUCTIONS[state]))
+    return ChatPromptTemplate.from_messages(messages)
+
+
+class DnDGameMaster:
+    def __init__(self, llm=None, verbose=True):
+        self.state = "world_selection"  # initial state
+        self.world_choice = None
+        self.world_setting = None
+        self.world_settings = WORLD_SETTINGS
+
+        if llm is None:
+            # Ollama by default, see llm_backends.py for the response cache and offline replay
+            llm = create_llm()
+        self.llm = llm
+        # self.llm = GPT4All(
+        #     model="/Users/kohjunkai/Library/Application Support/nomic.ai/GPT4All/"
+        # )
+        # Keeps the prompt size roughly constant: recent turns verbatim, older ones summarized
+        self.memory = RollingSummaryMemory(
+            llm=self.llm, memory_key="chat_history", return_messages=True
         )
+        self.verbose = verbose
+        # LLMChain per (state, world choice), built on first use
+        self.chains = {}
+        self.state_handlers = {
+            "world_selection": self.handle_world_selection,
+            "scenario_narration": self.process_message,
+        }
+        self.async_state_handlers = {
+            "world_selection": self.ahandle_world_selection,
+            "scenario_narration": self.aprocess_message,
+        }
         self.output_parser = StrOutputParser()
+        # Whether the last turn was answered by the model and stored in memory
+        self.last_turn_remembered = False
+        # Called with (narration, world_choice) after every narrated turn, e.g. to render scene art
+        self.narration_listeners = []
+
+    def get_chain(self, state, world_choice):
+        """
+        Returns the chain for a game state and world, building it the first time it is needed.
+        """
+        key = (state, world_choice)
+        chain = self.chains.get(key)
+        if chain is None:
+            chain = LLMChain(
+                llm=self.llm,
+                memory=self.memory,
+                verbose=self.verbose,
+                prompt=build_prompt(state, world_choice),
+            )
+            self.chains[key] = chain
+        return chain
+
+    @property
+    def chain(self):
+        return self.get_chain(self.state, self.world_choice)
+
+    @property
+    def prompt_template(self):
+        return self.chain.prompt
+
+    def get_callbacks(self, on_token):
+        """
+        Build the callback list for a chain call. Streaming is only enabled when on_token is given.
+        """
+        if on_token is None:
+            return None
+        return [TokenStreamHandler(on_token)]
 
-    def process_message(self, message):
-        response = self.chain.predict(user_input=message)
+    def process_message(self, message, on_token=None):
+        response = self.chain.predict(
+            user_input=message, callbacks=self.get_callbacks(on_token)
+        )
+        self.last_turn_remembered = True
+        self.notify_narration(response)
         return response
 
-    def process_input(self, message):
+    async def aprocess_message(self, message, on_token=None):
+        response = await self.chain.apredict(
+            user_input=message, callbacks=self.get_callbacks(on_token)
+        )
+        self.last_turn_remembered = True
+        self.notify_narration(response)
+        return response
+
+    def notify_narration(self, response):
+        for listener in self.narration_listeners:
+            try:
+                listener(response, self.world_choice)
+            except Exception as e:
+                print(f"Narration listener failed: {e}")
+
+    def process_input(self, message, on_token=None):
         """
         Main entry point for processing user input based on the current game state.
 
+        If on_token is given, it is called from the calling thread with each token of
+        the reply while the model is still generating. The full reply is returned either way.
         """
-        # return self.process_message(message)
-        if self.state == "world_selection":
-            return self.handle_world_selection(message)
-        elif self.state == "scenario_narration":
-            return self.process_message(message)
-        else:
+        self.last_turn_remembered = False
+        handler = self.state_handlers.get(self.state)
+        if handler is None:
             return "Unknown game state. Please restart."
+        return handler(message, on_token)
 
-    def handle_world_selection(self, message):
+    async def aprocess_input(self, message, on_token=None):
         """
-        Handle the selection of the game world.
+        Async version of process_input, used by the multi-session server.
+        """
+        self.last_turn_remembered = False
+        handler = self.async_state_handlers.get(self.state)
+        if handler is None:
+            return "Unknown game state. Please restart."
+        return await handler(message, on_token)
+
+    def parse_world_choice(self, message):
+        """
+        Returns the world number chosen in message, or None if it is not a valid choice.
         """
         try:
             user_choice = int(message)
-            print(user_choice, self.world_settings)
-            if user_choice not in self.world_settings:
-                return "Invalid choice. Please select 1, 2, or 3."
-
-            selected_world = self.world_settings[user_choice]
-            self.world_setting = selected_world
-            self.prompt_template = ChatPromptTemplate.from_messages(
-                [
-                    SystemMessage(
-                        content="You are a Game Master of a Dungeons and Dragons Quest. You create beautiful and immersive worlds for your players to explore."
-                    ),
-                    AIMessagePromptTemplate.from_template(
-                        "Welcome to AI Dungeons & Dragons! Please choose a world setting for your DnD quest: 1. The Shattered Isles 2. Jungle World 3. The Frozen Wastes"
-                    ),
-                    HumanMessagePromptTemplate.from_template(
-                        "Your choice: {user_input} - " + selected_world
-                    ),
-                    MessagesPlaceholder(variable_name="chat_history"),
-                    SystemMessage(
-                        content="Please generate 3 character options for the player to choose from. keep the details breif and short."
-                    ),
-                ]
-            )
-            self.chain = LLMChain(
-                llm=self.llm,
-                memory=self.memory,
-                verbose=True,
-                prompt=self.prompt_template,
-            )
-            response = self.chain.predict(user_input=message)
-
-            # update game state
-            self.prompt_template = self.prompt_template = (
-                ChatPromptTemplate.from_messages(
-                    [
-                        SystemMessage(
-                            content="You are a Game Master of a Dungeons and Dragons Quest."
-                        ),
-                        AIMessagePromptTemplate.from_template(
-                            "Welcome to AI Dungeons & Dragons! Please choose a world setting for your DnD quest: 1. The Shattered Isles 2. Jungle World 3. The Frozen Wastes"
-                        ),
-                        HumanMessagePromptTemplate.from_template(
-                            "Your choice: {user_input} - " + selected_world
-                        ),
-                        MessagesPlaceholder(variable_name="chat_history"),
-                        SystemMessage(
-                            content="Please continue to narrate the DnD story based on the chosen settings, player character choice and the subsequent action choices."
-                        ),
-                    ]
-                )
-            )
-            self.chain = LLMChain(
-                llm=self.llm,
-                memory=self.memory,
-                verbose=True,
-                prompt=self.prompt_template,
-            )
-            self.state = "scenario_narration"  # update game state
-            return response
         except ValueError:
+            return None
+        print(user_choice, self.world_settings)
+        if user_choice not in self.world_settings:
+            return None
+        return user_choice
+
+    def enter_world(self, user_choice):
+        # update game state
+        self.world_choice = user_choice
+        self.state = "scenario_narration"
+        self.last_turn_remembered = True
+
+    def get_state(self):
+        """
+        Returns everything needed to resume this game as a JSON-serializable dict.
+        """
+        return {
+            "state": self.state,
+            "world_choice": self.world_choice,
+            "memory": self.memory.get_state(),
+        }
+
+    def set_state(self, state):
+        """
+        Resumes a game saved with get_state.
+        """
+        self.state = state["state"]
+        self.set_world(state["world_choice"])
+        self.memory.set_state(state["memory"])
+
+    def set_world(self, world_choice):
+        self.world_choice = world_choice
+        self.world_setting = self.world_settings.get(world_choice)
+
+    def handle_world_selection(self, message, on_token=None):
+        """
+        Handle the selection of the game world.
+        """
+        user_choice = self.parse_world_choice(message)
+        if user_choice is None:
             return "Invalid choice. Please select 1, 2, or 3."
+        self.world_setting = self.world_settings[user_choice]
+        try:
+            response = self.get_chain("world_selection", user_choice).predict(
+                user_input=message, callbacks=self.get_callbacks(on_token)
+            )
+        except Exception as e:
+            return f"An unexpected error occurred: {e}. Please try again."
+        self.enter_world(user_choice)
+        return response
 
+    async def ahandle_world_selection(self, message, on_token=None):
+        user_choice = self.parse_world_choice(message)
+        if user_choice is None:
+            return "Invalid choice. Please select 1, 2, or 3."
+        self.world_setting = self.world_settings[user_choice]
+        try:
+            response = await self.get_chain("world_selection", user_choice).apredict(
+                user_input=message, callbacks=self.get_callbacks(on_token)
+            )
         except Exception as e:
-            return f"An unexpected error occurred: {e}. Please try again."
\ No newline at end of file
+            return f"An unexpected error occurred: {e}. Please try again."
+        self.enter_world(user_choice)
+        return response
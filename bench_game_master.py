@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for the per-turn overhead of DnDGameMaster outside the LLM call.
+
+The offline replay backend stands in for Ollama, so the numbers only cover prompt, memory and
+chain handling. World selection is compared against rebuilding two prompt templates and
+two LLMChains on every choice, as handle_world_selection used to do.
+
+Run command:
+    python bench_game_master.py [turns]
+"""
+import sys
+import time
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain.chains import LLMChain
+
+from DnDGameClasses import DnDGameMaster, build_prompt
+from llm_backends import ReplayChatModel
+
+
+def new_game_master():
+    game_master = DnDGameMaster(llm=ReplayChatModel(), verbose=False)
+    # Keep the window from filling so every turn sees the same prompt size
+    game_master.memory.window_turns = 10**6
+    game_master.memory.max_token_limit = 10**9
+    return game_master
+
+
+def rebuilt_world_selection(game_master, message):
+    """
+    World selection the way it used to be: a new template and chain for the reply and
+    another pair for the narration state, on every choice.
+    """
+    world_choice = int(message)
+    chain = LLMChain(
+        llm=game_master.llm,
+        memory=game_master.memory,
+        verbose=False,
+        prompt=ChatPromptTemplate.from_messages(
+            build_prompt("world_selection", world_choice).messages
+        ),
+    )
+    response = chain.predict(user_input=message)
+    LLMChain(
+        llm=game_master.llm,
+        memory=game_master.memory,
+        verbose=False,
+        prompt=ChatPromptTemplate.from_messages(
+            build_prompt("scenario_narration", world_choice).messages
+        ),
+    )
+    return response
+
+
+def time_world_selection(turns, rebuild):
+    game_master = new_game_master()
+    t = time.perf_counter()
+    for i in range(turns):
+        message = str(i % 3 + 1)
+        if rebuild:
+            rebuilt_world_selection(game_master, message)
+        else:
+            game_master.state = "world_selection"
+            game_master.process_input(message)
+        game_master.memory.clear()
+    return (time.perf_counter() - t) / turns
+
+
+def time_narration(turns):
+    game_master = new_game_master()
+    game_master.process_input("1")
+    t = time.perf_counter()
+    for i in range(turns):
+        game_master.process_input(f"I look around {i}")
+        game_master.memory.clear()
+    return (time.perf_counter() - t) / turns
+
+
+if __name__ == "__main__":
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rebuilt = time_world_selection(turns, rebuild=True)
+    cached = time_world_selection(turns, rebuild=False)
+    narration = time_narration(turns)
+    print(f"world selection, rebuilt chains: {rebuilt * 1e6:9.1f} us/turn")
+    print(f"world selection, cached chains:  {cached * 1e6:9.1f} us/turn")
+    print(f"narration, cached chain:         {narration * 1e6:9.1f} us/turn")
@@ -0,0 +1,192 @@
+from collections import deque
+import itertools
+import tkinter as tk
+
+PREFIXES = {"user": "\nYou: ", "ai": "Game Master: "}
+
+
+class ChatView:
+    """
+    Chat history that keeps only a window of messages in its Text widget.
+
+    Tk text widgets get slower to edit and scroll the more text they hold, so at most
+    max_messages messages are kept in the widget. The oldest ones are dropped as new
+    ones arrive and are paged back in from the session store, page_size at a time, when
+    the player scrolls to the top. Paging in older messages drops the newest ones, which
+    are paged back in on scrolling down; a new message jumps back to the latest ones.
+    Must be used from the Tk thread.
+    """
+
+    def __init__(self, widget, store, max_messages=200, page_size=50):
+        self.widget = widget
+        self.store = store
+        self.max_messages = max_messages
+        self.page_size = page_size
+        # [mark, seq, streaming] per displayed message, oldest first; seq is None for
+        # messages that are not in the store (yet)
+        self.messages = deque()
+        self.mark_ids = itertools.count()
+        self.older_until = 0  # stored messages with a lower seq are not displayed
+        self.newer_from = None  # stored messages from this seq on are not displayed
+        self.paging = False
+        widget.configure(yscrollcommand=self.on_scroll)
+
+    def load_latest(self, until=None):
+        """
+        Replaces the contents of the widget with the newest stored messages before until.
+        """
+        if until is None:
+            until = self.store.next_seq
+        self.widget.configure(state=tk.NORMAL)
+        self.widget.delete("1.0", tk.END)
+        for entry in self.messages:
+            self.widget.mark_unset(entry[0])
+        self.messages.clear()
+        records = self.store.read_range(max(0, until - self.max_messages), until)
+        for record in records:
+            self.insert_bottom(record["role"], record["text"], record["seq"])
+        self.older_until = records[0]["seq"] if records else until
+        self.newer_from = None
+        self.widget.configure(state=tk.DISABLED)
+        self.widget.yview_moveto(1.0)
+
+    def add_message(self, role, text, seq=None):
+        """
+        Appends a complete message. seq is its sequence number in the store, if it was saved.
+        """
+        self.show_latest(until=seq)
+        follow = self.at_bottom()
+        self.widget.configure(state=tk.NORMAL)
+        self.insert_bottom(role, text, seq)
+        self.trim_top()
+        self.widget.configure(state=tk.DISABLED)
+        if follow:
+            self.widget.yview_moveto(1.0)
+
+    def begin_message(self, role="ai"):
+        """
+        Starts a message that will be filled in by append_text and completed by end_message.
+        """
+        self.show_latest()
+        follow = self.at_bottom()
+        self.widget.configure(state=tk.NORMAL)
+        start = self.widget.index("end-1c")
+        self.widget.insert(tk.END, PREFIXES[role], role)
+        self.messages.append(self.new_mark(start, None, streaming=True))
+        self.trim_top()
+        self.widget.configure(state=tk.DISABLED)
+        if follow:
+            self.widget.yview_moveto(1.0)
+
+    def append_text(self, text, role="ai"):
+        follow = self.at_bottom()
+        self.widget.configure(state=tk.NORMAL)
+        self.widget.insert(tk.END, text, role)
+        self.widget.configure(state=tk.DISABLED)
+        if follow:
+            self.widget.yview_moveto(1.0)
+
+    def end_message(self, seq=None, role="ai"):
+        self.append_text("\n", role)
+        for entry in reversed(self.messages):
+            if entry[2]:
+                entry[1] = seq
+                entry[2] = False
+                break
+
+    def show_latest(self, until=None):
+        """
+        Brings back the newest messages if older ones were paged in over them.
+        """
+        if self.newer_from is not None:
+            self.load_latest(until)
+
+    def at_bottom(self):
+        return self.widget.yview()[1] >= 1.0
+
+    def new_mark(self, index, seq, streaming=False):
+        mark = f"message-{next(self.mark_ids)}"
+        # Right gravity: text inserted at the top of the widget pushes the mark along
+        self.widget.mark_set(mark, index)
+        self.widget.mark_gravity(mark, tk.RIGHT)
+        return [mark, seq, streaming]
+
+    def insert_bottom(self, role, text, seq):
+        start = self.widget.index("end-1c")
+        self.widget.insert(tk.END, f"{PREFIXES[role]}{text}\n", role)
+        self.messages.append(self.new_mark(start, seq))
+
+    def insert_top(self, role, text, seq):
+        self.widget.insert("1.0", f"{PREFIXES[role]}{text}\n", role)
+        self.messages.appendleft(self.new_mark("1.0", seq))
+
+    def trim_top(self):
+        while len(self.messages) > self.max_messages:
+            mark, seq, _ = self.messages.popleft()
+            self.widget.delete(mark, self.messages[0][0])
+            self.widget.mark_unset(mark)
+            if seq is not None:
+                self.older_until = seq + 1
+
+    def trim_bottom(self):
+        while len(self.messages) > self.max_messages and not self.messages[-1][2]:
+            mark, seq, _ = self.messages.pop()
+            self.widget.delete(mark, "end-1c")
+            self.widget.mark_unset(mark)
+            if seq is not None:
+                self.newer_from = seq
+
+    def page_older(self):
+        try:
+            records = self.store.read_range(
+                max(0, self.older_until - self.page_size), self.older_until
+            )
+            if not records:
+                self.older_until = 0
+                return
+            anchor = self.messages[0][0] if self.messages else None
+            self.widget.configure(state=tk.NORMAL)
+            for record in reversed(records):
+                self.insert_top(record["role"], record["text"], record["seq"])
+            self.older_until = records[0]["seq"]
+            self.trim_bottom()
+            self.widget.configure(state=tk.DISABLED)
+            if anchor is not None:
+                # Keep the message that was at the top in place
+                self.widget.yview(anchor)
+        finally:
+            self.paging = False
+
+    def page_newer(self):
+        try:
+            records = self.store.read_range(self.newer_from, self.newer_from + self.page_size)
+            if not records:
+                self.newer_from = None
+                return
+            anchor = self.messages[-1][0] if self.messages else None
+            self.widget.configure(state=tk.NORMAL)
+            for record in records:
+                self.insert_bottom(record["role"], record["text"], record["seq"])
+            self.newer_from = records[-1]["seq"] + 1
+            if self.newer_from >= self.store.next_seq:
+                self.newer_from = None
+            self.trim_top()
+            self.widget.configure(state=tk.DISABLED)
+            if anchor is not None:
+                self.widget.see(anchor)
+        finally:
+            self.paging = False
+
+    def on_scroll(self, first, last):
+        """
+        yscrollcommand of the widget: updates the scrollbar and pages messages in at either end.
+        """
+        self.widget.vbar.set(first, last)
+        if self.paging:
+            return
+        if float(first) <= 0.0 and self.older_until > 0:
+            self.paging = True
+            self.widget.after_idle(self.page_older)
+        elif float(last) >= 1.0 and self.newer_from is not None:
+            self.paging = True
+            self.widget.after_idle(self.page_newer)
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from typing import Any, Dict, List
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import (
+    BaseMessage,
+    SystemMessage,
+    get_buffer_string,
+    messages_from_dict,
+    messages_to_dict,
+)
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.pydantic_v1 import Field
+
+# One summarizer thread is shared by every memory so background summaries never
+# compete with each other for the model
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+
+
+def estimate_tokens(text):
+    """
+    Rough token count, about 4 characters per token for llama2. Good enough for a budget
+    and avoids loading a tokenizer on every turn.
+    """
+    return len(text) // 4 + 1
+
+
+class RollingSummaryMemory(BaseChatMemory):
+    """
+    Conversation memory with a bounded prompt footprint.
+
+    The last window_turns exchanges are kept verbatim, older exchanges are folded into a
+    running summary, and the verbatim window is trimmed further whenever summary plus
+    window exceed max_token_limit. Summaries are produced on a background thread after
+    the reply has been returned, so they never add to the latency of a turn. Exchanges
+    that were evicted but not summarized yet are left out of the prompt until they are.
+    """
+
+    llm: BaseLanguageModel
+    memory_key: str = "chat_history"
+    window_turns: int = 6
+    max_token_limit: int = 1500
+    summary: str = ""
+    # Messages evicted from the window that still have to be folded into the summary
+    pending: List[BaseMessage] = Field(default_factory=list)
+    summarizing: bool = False
+    lock: Any = Field(default_factory=threading.Lock)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            messages = list(self.chat_memory.messages)
+            summary = self.summary
+        if summary:
+            messages = [
+                SystemMessage(content="Summary of the story so far: " + summary)
+            ] + messages
+        if not self.return_messages:
+            return {self.memory_key: get_buffer_string(messages)}
+        return {self.memory_key: messages}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        with self.lock:
+            self.trim_window()
+            start_summary = len(self.pending) > 0 and not self.summarizing
+            if start_summary:
+                self.summarizing = True
+        if start_summary:
+            summary_executor.submit(self.update_summary)
+
+    def trim_window(self) -> None:
+        """
+        Moves the oldest exchanges out of the verbatim window once it exceeds the turn or token
+        limits. Always keeps the latest exchange. Call with the lock held.
+        """
+        messages = self.chat_memory.messages
+        budget = self.max_token_limit - estimate_tokens(self.summary)
+        keep_turns = self.window_turns
+        if len(messages) > 2 * self.window_turns:
+            # Evict half the window at once so the verbatim part of the prompt, and with it
+            # the prefix Ollama can reuse from its KV cache, stays unchanged for several turns
+            keep_turns = max(1, self.window_turns // 2)
+        while len(messages) > 2 and (
+            len(messages) > 2 * keep_turns
+            or estimate_tokens(get_buffer_string(messages)) > budget
+        ):
+            self.pending.extend(messages[:2])
+            del messages[:2]
+
+    def update_summary(self) -> None:
+        """
+        Folds pending messages into the summary until none are left. Runs on summary_executor.
+        """
+        chain = SUMMARY_PROMPT | self.llm | StrOutputParser()
+        while True:
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+                summary = self.summary
+                if not batch:
+                    self.summarizing = False
+                    return
+            try:
+                new_summary = chain.invoke(
+                    {"summary": summary, "new_lines": get_buffer_string(batch)}
+                )
+            except Exception as e:
+                print(f"Failed to update the conversation summary: {e}")
+                with self.lock:
+                    self.pending = batch + self.pending
+                    self.summarizing = False
+                return
+            with self.lock:
+                self.summary = new_summary.strip()
+                self.trim_window()
+
+    def clear(self) -> None:
+        super().clear()
+        with self.lock:
+            self.summary = ""
+            self.pending = []
+
+    def add_turn(self, user_message, ai_message) -> None:
+        """
+        Adds an exchange without starting a summary, e.g. while restoring a saved game.
+        Evicted exchanges are summarized after the next live turn.
+        """
+        with self.lock:
+            self.chat_memory.add_user_message(user_message)
+            self.chat_memory.add_ai_message(ai_message)
+            self.trim_window()
+
+    def get_state(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "summary": self.summary,
+                "messages": messages_to_dict(self.chat_memory.messages),
+                "pending": messages_to_dict(self.pending),
+            }
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        with self.lock:
+            self.summary = state["summary"]
+            self.chat_memory.messages = messages_from_dict(state["messages"])
+            self.pending = messages_from_dict(state["pending"])
@@ -0,0 +1,248 @@
+import itertools
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client
+
+GENERATOR_DIR = "image_generator_comfyui"
+GENERATOR_PYTHON = os.path.join("python_embeded", "python.exe")
+WORKER_SCRIPT = "generation_worker.py"
+WORKER_PORT = 8765
+AUTHKEY = os.environ.get("DND_GENERATION_AUTHKEY", "dnd-generation").encode()
+
+# Job priorities, lower runs first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_PREFETCH = 20
+
+
+class GenerationError(Exception):
+    """
+    Raised through a job's future when the generation worker fails to run it.
+    """
+
+
+class GenerationClient:
+    """
+    Submits image generation jobs to a long-lived generation_worker.py process.
+
+    The worker is started on first use and keeps its models loaded, so only the first
+    job pays for the ComfyUI import and checkpoint load. Every submitted job returns a
+    concurrent.futures.Future that resolves to the list of saved image paths.
+    """
+
+    def __init__(self, port=WORKER_PORT, worker_args=(), connect_timeout=300):
+        self.port = port
+        self.worker_args = list(worker_args)
+        self.connect_timeout = connect_timeout
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.futures = {}
+        self.job_ids = itertools.count(1)
+
+    def start_worker(self):
+        """
+        Launches the worker process with the embedded python of the image generator.
+        """
+        # Absolute, because on Windows a relative executable is looked up from our cwd, not cwd=
+        python = os.path.abspath(os.path.join(GENERATOR_DIR, GENERATOR_PYTHON))
+        try:
+            self.process = subprocess.Popen(
+                [
+                    python,
+                    "-s",
+                    WORKER_SCRIPT,
+                    "--worker-port",
+                    str(self.port),
+                ]
+                + self.worker_args,
+                cwd=GENERATOR_DIR,
+            )
+        except OSError as e:
+            raise GenerationError(f"Could not start the generation worker with {python}: {e}") from e
+
+    def connect(self):
+        """
+        Returns the connection to the worker, starting the worker if nobody is listening yet.
+        Blocks until the worker accepts the connection, so call it off the UI thread.
+        """
+        with self.lock:
+            if self.conn is not None:
+                return self.conn
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    self.conn = Client(("127.0.0.1", self.port), authkey=AUTHKEY)
+                    break
+                except ConnectionRefusedError:
+                    if self.process is None:
+                        self.start_worker()
+                    elif self.process.poll() is not None:
+                        raise GenerationError(
+                            f"Generation worker exited with code {self.process.returncode}"
+                        )
+                    if time.monotonic() > deadline:
+                        raise GenerationError("Timed out waiting for the generation worker")
+                    time.sleep(0.5)
+            threading.Thread(target=self.read_results, args=(self.conn,), daemon=True).start()
+            return self.conn
+
+    def read_results(self, conn):
+        """
+        Resolves job futures as the worker reports results. Runs on its own thread.
+        """
+        try:
+            while True:
+                status, job_id, result = conn.recv()
+                future = self.futures.pop(job_id, None)
+                if future is None:
+                    continue
+                if status == "done":
+                    future.set_result(result)
+                elif status == "cancelled":
+                    future.cancel()
+                else:
+                    future.set_exception(GenerationError(result))
+        except (EOFError, OSError):
+            pass
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+        # Jobs in flight on a dead connection will never complete
+        for job_id in list(self.futures):
+            future = self.futures.pop(job_id, None)
+            if future is not None:
+                future.set_exception(GenerationError("Lost connection to the generation worker"))
+
+    def submit(self, kind, payload=None, priority=PRIORITY_NORMAL):
+        """
+        Queues a job on the worker and returns a Future for the saved image paths.
+
+        kind is "portraits" or "backgrounds"; payload is the characters/backgrounds dict
+        for the corresponding script, or None for its defaults.
+        """
+        conn = self.connect()
+        job_id = next(self.job_ids)
+        future = Future()
+        future.job_id = job_id
+        self.futures[job_id] = future
+        with self.send_lock:
+            conn.send(("submit", job_id, kind, payload, priority))
+        return future
+
+    def send_control(self, message):
+        with self.lock:
+            conn = self.conn
+        if conn is None:
+            return
+        try:
+            with self.send_lock:
+                conn.send(message)
+        except OSError:
+            pass
+
+    def cancel(self, future):
+        """
+        Cancels a job. A job that has not started yet is dropped and a running one is
+        interrupted at its next sampling step; the future is cancelled once the worker confirms.
+        """
+        if not future.done():
+            self.send_control(("cancel", future.job_id))
+
+    def reprioritize(self, future, priority):
+        """
+        Moves a job that has not started yet to a new priority.
+        """
+        if not future.done():
+            self.send_control(("reprioritize", future.job_id, priority))
+
+    def close(self):
+        """
+        Asks the worker to exit if this client started it.
+        """
+        with self.lock:
+            conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                if self.process is not None:
+                    with self.send_lock:
+                        conn.send(("shutdown",))
+                conn.close()
+            except OSError:
+                pass
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+
+class BackgroundPrefetcher:
+    """
+    Speculatively renders the background of every world while the player is still choosing.
+
+    start() queues one low priority job per world. Once the player picks, choose()
+    promotes that world's job and cancels the others that have not started, so the
+    chosen art is usually ready by the time the first narration arrives.
+    """
+
+    def __init__(self, client, world_backgrounds, on_ready=None):
+        self.client = client
+        self.world_backgrounds = world_backgrounds
+        self.on_ready = on_ready
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.chosen = None
+
+    def start(self):
+        threading.Thread(target=self.submit_all, daemon=True).start()
+
+    def submit_all(self):
+        """
+        Submits the background jobs. Runs on its own thread because the first submit waits for the worker.
+        """
+        for world, backgrounds in self.world_backgrounds.items():
+            with self.lock:
+                if self.chosen is not None and self.chosen != world:
+                    continue
+                priority = PRIORITY_HIGH if self.chosen == world else PRIORITY_PREFETCH
+            try:
+                future = self.client.submit("backgrounds", backgrounds, priority)
+            except Exception as e:
+                print(f"Failed to prefetch world backgrounds: {e}")
+                return
+            with self.lock:
+                self.futures[world] = future
+                chosen = self.chosen
+            if chosen is not None:
+                self.apply_choice(world, future, chosen)
+
+    def choose(self, world):
+        """
+        Records the player's world choice and adjusts the pending prefetch jobs.
+        """
+        with self.lock:
+            if self.chosen is not None:
+                return
+            self.chosen = world
+            futures = dict(self.futures)
+        for other, future in futures.items():
+            self.apply_choice(other, future, world)
+
+    def apply_choice(self, world, future, chosen):
+        if world != chosen:
+            self.client.cancel(future)
+            return
+        self.client.reprioritize(future, PRIORITY_HIGH)
+        if self.on_ready is not None:
+            future.add_done_callback(self.report_ready)
+
+    def report_ready(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        self.on_ready(future.result())
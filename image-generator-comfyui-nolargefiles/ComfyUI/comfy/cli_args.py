@@ -103,6 +103,17 @@ vram_group.add_argument("--novram", action="store_true", help="When lowvram isn'
 vram_group.add_argument("--cpu", action="store_true", help="To use the CPU for everything (slow).")
 
 
+parser.add_argument("--lora-cache-mb", type=float, default=1024, help="How many MB of loaded LoRA files to keep in memory for reuse. 0 disables the cache.")
+parser.add_argument("--clip-cache-mb", type=float, default=128, help="How many MB of text encoder outputs to keep for prompts that are encoded again. 0 disables the cache.")
+parser.add_argument("--mmap-weights", action="store_true", help="Memory map .safetensors checkpoints and keep the unet weights that run on the CPU as views of the file, in the dtype they are stored in, so processes using the same checkpoint share them through the OS page cache. Weights patched by a LoRA (kept in the dtype used without this option), the text encoder and the VAE are still private to each process.")
+parser.add_argument("--lora-mmap", action="store_true", help="Memory map .safetensors LoRA files instead of reading them, so cached LoRAs share the OS page cache.")
+
+parser.add_argument("--cache-max-entries", type=int, default=256, help="How many node outputs of earlier prompts to keep for reuse. The outputs of the latest prompt are always kept.")
+parser.add_argument("--cache-ram-mb", type=float, default=8192, help="How many MB of cached node outputs to keep for reuse, counting the weights of cached models (checkpoints, text encoders, VAEs) as well as latents, images and conditioning. The outputs of the latest prompt are always kept.")
+parser.add_argument("--parallel-execution", action="store_true", help="Run independent nodes of a prompt at the same time: nodes run on a thread pool for their resource class (accelerator, cpu or io) instead of one at a time.")
+parser.add_argument("--parallel-cpu-workers", type=int, default=2, help="Threads for cpu nodes with --parallel-execution.")
+parser.add_argument("--parallel-io-workers", type=int, default=2, help="Threads for io nodes, like loading and saving images, with --parallel-execution.")
+
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
@@ -1,4 +1,8 @@
 import comfy.utils
+from comfy.cli_args import args
+import os
+import threading
+from collections import OrderedDict
 
 LORA_CLIP_MAP = {
     "mlp.fc1": "mlp_fc1",
@@ -222,3 +226,63 @@ def model_lora_keys_unet(model, key_map={}):
                     diffusers_lora_key = diffusers_lora_key[:-2]
                 key_map[diffusers_lora_key] = unet_key
     return key_map
+
+
+def state_dict_size(sd):
+    return sum(t.nelement() * t.element_size() for t in sd.values())
+
+class LoraCache:
+    #process wide cache of lora state dicts, so switching between loras doesn't read them from disk again
+    #entries are keyed by path, file mtime and size so an edited file gets loaded again
+    #least recently used entries are evicted once the cache holds more than max_bytes
+    #with use_mmap, safetensors files are mmapped instead of read so cached entries share the page cache
+    def __init__(self, max_bytes=1024 * 1024 * 1024, use_mmap=False):
+        self.max_bytes = max_bytes
+        self.use_mmap = use_mmap
+        self.entries = OrderedDict() #path -> (file key, state dict, size in bytes)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def load(self, lora_path):
+        st = os.stat(lora_path)
+        file_key = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            entry = self.entries.get(lora_path)
+            if entry is not None and entry[0] == file_key:
+                self.entries.move_to_end(lora_path)
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+
+        if self.use_mmap and lora_path.lower().endswith(".safetensors"):
+            lora = comfy.utils.load_safetensors_mmap(lora_path)
+        else:
+            lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
+        size = state_dict_size(lora)
+
+        with self.lock:
+            old = self.entries.pop(lora_path, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            if size <= self.max_bytes:
+                self.entries[lora_path] = (file_key, lora, size)
+                self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.stats["evictions"] += 1
+        return lora
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+lora_cache = None
+
+def get_lora_cache():
+    global lora_cache
+    if lora_cache is None:
+        lora_cache = LoraCache(max_bytes=int(args.lora_cache_mb * 1024 * 1024), use_mmap=args.lora_mmap)
+    return lora_cache
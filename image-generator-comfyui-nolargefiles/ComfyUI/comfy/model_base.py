@@ -5,6 +5,7 @@ from comfy.ldm.modules.diffusionmodules.upscaling import ImageConcatWithNoiseAug
 import comfy.model_management
 import comfy.conds
 import comfy.ops
+import comfy.cli_args
 from enum import Enum
 from . import utils
 
@@ -163,7 +164,10 @@ class BaseModel(torch.nn.Module):
                 to_load[k[len(unet_prefix):]] = sd.pop(k)
 
         to_load = self.model_config.process_unet_state_dict(to_load)
-        m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
+        if comfy.cli_args.args.mmap_weights and next(self.diffusion_model.parameters()).device.type == "cpu":
+            m, u = self.assign_model_weights(to_load)
+        else:
+            m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
         if len(m) > 0:
             print("unet missing:", m)
 
@@ -172,6 +176,20 @@ class BaseModel(torch.nn.Module):
         del to_load
         return self
 
+    def assign_model_weights(self, to_load):
+        #use the (mmapped) tensors as the parameters instead of copying them, so processes share the memory
+        #weights stored in another dtype than the model runs in still have to be converted into private memory,
+        #load_checkpoint_guess_config picks the stored dtype under --mmap-weights to avoid that. Weights that
+        #a LoRA patches are replaced by private tensors, in the dtype used without mmap, while the patch is applied
+        params = self.diffusion_model.state_dict()
+        for k in to_load:
+            if k in params and to_load[k].dtype != params[k].dtype:
+                to_load[k] = to_load[k].to(params[k].dtype)
+        try:
+            return self.diffusion_model.load_state_dict(to_load, strict=False, assign=True)
+        except TypeError: #pytorch without load_state_dict(assign=...)
+            return self.diffusion_model.load_state_dict(to_load, strict=False)
+
     def process_latent_in(self, latent):
         return self.latent_format.process_in(latent)
 
@@ -23,6 +23,7 @@ class ModelPatcher:
             self.current_device = current_device
 
         self.weight_inplace_update = weight_inplace_update
+        self.patched_weight_dtype = None #dtype of the weights a patch replaces, None keeps the dtype of the weight
 
     def model_size(self):
         if self.size > 0:
@@ -41,6 +42,7 @@ class ModelPatcher:
         n.object_patches = self.object_patches.copy()
         n.model_options = copy.deepcopy(self.model_options)
         n.model_keys = self.model_keys
+        n.patched_weight_dtype = self.patched_weight_dtype
         return n
 
     def is_clone(self, other):
@@ -199,7 +201,10 @@ class ModelPatcher:
                     temp_weight = comfy.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
                 else:
                     temp_weight = weight.to(torch.float32, copy=True)
-                out_weight = self.calculate_weight(self.patches[key], temp_weight, key).to(weight.dtype)
+                out_dtype = weight.dtype
+                if self.patched_weight_dtype is not None and not inplace_update:
+                    out_dtype = self.patched_weight_dtype
+                out_weight = self.calculate_weight(self.patches[key], temp_weight, key).to(out_dtype)
                 if inplace_update:
                     comfy.utils.copy_to_param(self.model, key, out_weight)
                 else:
@@ -25,6 +25,37 @@ def prepare_noise(latent_image, seed, noise_inds=None):
     noises = torch.cat(noises, axis=0)
     return noises
 
+def prepare_noise_per_seed(latent_image, seeds):
+    """
+    creates the noise for a batch where every item has its own seed.
+    item i gets exactly the noise prepare_noise gives a batch of one with seeds[i], so a batched run starts from the same noise as separate runs
+    """
+    noises = [prepare_noise(latent_image[i:i+1], seed) for i, seed in enumerate(seeds)]
+    return torch.cat(noises, axis=0)
+
+def batch_conditioning(conditionings):
+    """
+    stacks one single entry conditioning per batch item into a conditioning whose tensors are batched.
+    returns None if they can't be stacked, e.g. prompts that encode to a different number of tokens.
+    """
+    if any(len(c) != 1 for c in conditionings):
+        return None
+    tensors = [c[0][0] for c in conditionings]
+    if any(t.shape != tensors[0].shape for t in tensors):
+        return None
+    options = {}
+    for k, v in conditionings[0][0][1].items():
+        values = [c[0][1].get(k) for c in conditionings]
+        if torch.is_tensor(v):
+            if any(not torch.is_tensor(x) or x.shape != v.shape for x in values):
+                return None
+            options[k] = torch.cat(values)
+        elif any(x != v for x in values):
+            return None
+        else:
+            options[k] = v
+    return [[torch.cat(tensors), options]]
+
 def prepare_mask(noise_mask, shape, device):
     """ensures noise mask is of proper dimensions"""
     noise_mask = torch.nn.functional.interpolate(noise_mask.reshape((-1, 1, noise_mask.shape[-2], noise_mask.shape[-1])), size=(shape[2], shape[3]), mode="bilinear")
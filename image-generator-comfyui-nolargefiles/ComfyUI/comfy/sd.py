@@ -21,6 +21,10 @@ import comfy.lora
 import comfy.t2i_adapter.adapter
 import comfy.supported_models_base
 import comfy.taesd.taesd
+from comfy.cli_args import args
+import threading
+import weakref
+from collections import OrderedDict
 
 def load_model_weights(model, sd):
     m, u = model.load_state_dict(sd, strict=False)
@@ -82,6 +86,101 @@ def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
     return (new_modelpatcher, new_clip)
 
 
+def tokens_key(tokens):
+    #hashable version of a tokenize_with_weights result, None if it holds embedding tensors
+    if isinstance(tokens, dict):
+        items = []
+        for k in sorted(tokens):
+            v = tokens_key(tokens[k])
+            if v is None:
+                return None
+            items.append((k, v))
+        return tuple(items)
+    if isinstance(tokens, (list, tuple)):
+        items = []
+        for t in tokens:
+            v = tokens_key(t)
+            if v is None:
+                return None
+            items.append(v)
+        return tuple(items)
+    if torch.is_tensor(tokens):
+        return None
+    return tokens
+
+def patch_key(patch, tensors):
+    #hashable stand-in for a patch: its tensors by identity, everything else by value. load_lora builds
+    #new patch tuples on every call, but their tensors come from the lora file shared through the lora
+    #cache, so the same lora at the same strength gives the same key. the tensors are added to tensors
+    #so the entry can keep them alive and their ids can't be reused
+    if torch.is_tensor(patch):
+        tensors.append(patch)
+        return ("tensor", id(patch))
+    if isinstance(patch, (list, tuple)):
+        return tuple(patch_key(p, tensors) for p in patch)
+    if patch is None or isinstance(patch, (bool, int, float, str)):
+        return patch
+    tensors.append(patch)
+    return ("object", id(patch))
+
+class ConditioningCache:
+    #caches text encoder outputs, keyed by the tokens with their weights, the text encoder, the patches
+    #on it (loras with their strengths) and the clip layer, so identical prompts across jobs are encoded once
+    #bounded by the bytes of the cached tensors, least recently used entries are evicted first
+    def __init__(self, max_bytes=128 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() #key -> (model weakref, patch tensors, cond, pooled, size in bytes)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def make_key(self, clip, tokens):
+        tk = tokens_key(tokens)
+        if tk is None or self.max_bytes <= 0:
+            return None, None
+        patches = clip.patcher.patches
+        patch_tensors = []
+        patch_keys = []
+        for k in sorted(patches):
+            for strength_patch, patch, strength_model in patches[k]:
+                patch_keys.append((k, strength_patch, patch_key(patch, patch_tensors), strength_model))
+        key = (id(clip.cond_stage_model), tuple(patch_keys), clip.layer_idx, tk)
+        return key, patch_tensors
+
+    def get(self, clip, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0]() is not clip.cond_stage_model:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[2], entry[3]
+
+    def put(self, clip, key, patch_tensors, cond, pooled):
+        size = cond.nelement() * cond.element_size()
+        if pooled is not None:
+            size += pooled.nelement() * pooled.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[4]
+            self.entries[key] = (weakref.ref(clip.cond_stage_model), patch_tensors, cond, pooled, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted[4]
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+conditioning_cache = ConditioningCache(max_bytes=int(args.clip_cache_mb * 1024 * 1024))
+
 class CLIP:
     def __init__(self, target=None, embedding_directory=None, no_init=False):
         if no_init:
@@ -100,6 +199,8 @@ class CLIP:
         self.tokenizer = tokenizer(embedding_directory=embedding_directory)
         self.patcher = comfy.model_patcher.ModelPatcher(self.cond_stage_model, load_device=load_device, offload_device=offload_device)
         self.layer_idx = None
+        #clones share the text encoder, its clip layer and loaded patches, so they encode one at a time
+        self.encode_lock = threading.RLock()
 
     def clone(self):
         n = CLIP(no_init=True)
@@ -107,6 +208,7 @@ class CLIP:
         n.cond_stage_model = self.cond_stage_model
         n.tokenizer = self.tokenizer
         n.layer_idx = self.layer_idx
+        n.encode_lock = self.encode_lock
         return n
 
     def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
@@ -119,13 +221,24 @@ class CLIP:
         return self.tokenizer.tokenize_with_weights(text, return_word_ids)
 
     def encode_from_tokens(self, tokens, return_pooled=False):
-        if self.layer_idx is not None:
-            self.cond_stage_model.clip_layer(self.layer_idx)
-        else:
-            self.cond_stage_model.reset_clip_layer()
+        key, patch_tensors = conditioning_cache.make_key(self, tokens)
+        cached = conditioning_cache.get(self, key) if key is not None else None
+        if cached is not None:
+            cond, pooled = cached
+            if return_pooled:
+                return cond, pooled
+            return cond
+
+        with self.encode_lock:
+            if self.layer_idx is not None:
+                self.cond_stage_model.clip_layer(self.layer_idx)
+            else:
+                self.cond_stage_model.reset_clip_layer()
 
-        self.load_model()
-        cond, pooled = self.cond_stage_model.encode_token_weights(tokens)
+            self.load_model()
+            cond, pooled = self.cond_stage_model.encode_token_weights(tokens)
+        if key is not None:
+            conditioning_cache.put(self, key, patch_tensors, cond, pooled)
         if return_pooled:
             return cond, pooled
         return cond
@@ -440,6 +553,13 @@ def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, o
     parameters = comfy.utils.calculate_parameters(sd, "model.diffusion_model.")
     unet_dtype = model_management.unet_dtype(model_params=parameters)
     load_device = model_management.get_torch_device()
+    compute_dtype = unet_dtype
+    if args.mmap_weights and model_management.is_device_cpu(load_device):
+        #run the unet in the dtype it is stored in so its weights stay views of the mmapped file,
+        #converting them would make a private copy per process. Manual cast converts at compute time
+        stored_dtype = comfy.utils.weight_dtype(sd, "model.diffusion_model.")
+        if stored_dtype in (torch.float16, torch.bfloat16, torch.float32):
+            unet_dtype = stored_dtype
     manual_cast_dtype = model_management.unet_manual_cast(unet_dtype, load_device)
 
     class WeightsLoader(torch.nn.Module):
@@ -481,6 +601,10 @@ def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, o
 
     if output_model:
         model_patcher = comfy.model_patcher.ModelPatcher(model, load_device=load_device, offload_device=model_management.unet_offload_device(), current_device=inital_load_device)
+        if unet_dtype != compute_dtype:
+            #weights a LoRA patches are private anyway, keep them in the dtype the unet would have without
+            #--mmap-weights so the patched model gives the same images as without it
+            model_patcher.patched_weight_dtype = compute_dtype
         if inital_load_device != torch.device("cpu"):
             print("loaded straight to GPU")
             model_management.load_model_gpu(model_patcher)
@@ -1,7 +1,10 @@
 import torch
 import math
 import struct
+import json
+import mmap
 import comfy.checkpoint_pickle
+from comfy.cli_args import args
 import safetensors.torch
 import numpy as np
 from PIL import Image
@@ -10,7 +13,10 @@ def load_torch_file(ckpt, safe_load=False, device=None):
     if device is None:
         device = torch.device("cpu")
     if ckpt.lower().endswith(".safetensors"):
-        sd = safetensors.torch.load_file(ckpt, device=device.type)
+        if args.mmap_weights and device.type == "cpu":
+            sd = load_safetensors_mmap(ckpt)
+        else:
+            sd = safetensors.torch.load_file(ckpt, device=device.type)
     else:
         if safe_load:
             if not 'weights_only' in torch.load.__code__.co_varnames:
@@ -41,6 +47,17 @@ def calculate_parameters(sd, prefix=""):
             params += sd[k].nelement()
     return params
 
+def weight_dtype(sd, prefix=""):
+    #the dtype most of the weights under prefix are stored in
+    dtypes = {}
+    for k in sd.keys():
+        if k.startswith(prefix):
+            w = sd[k]
+            dtypes[w.dtype] = dtypes.get(w.dtype, 0) + w.nelement()
+    if len(dtypes) == 0:
+        return None
+    return max(dtypes, key=dtypes.get)
+
 def state_dict_key_replace(state_dict, keys_to_replace):
     for x in keys_to_replace:
         if x in state_dict:
@@ -273,6 +290,41 @@ def safetensors_header(safetensors_path, max_size=100*1024*1024):
             return None
         return f.read(length_of_header)
 
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+def load_safetensors_mmap(safetensors_path):
+    #cpu tensors that are views into a copy-on-write mmap of the file: they share the page cache
+    #instead of being read into private memory, and pages are only read when a tensor is used
+    with open(safetensors_path, "rb") as f:
+        length_of_header = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(length_of_header))
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    data_start = 8 + length_of_header
+    sd = {}
+    for k in header:
+        if k == "__metadata__":
+            continue
+        info = header[k]
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if end == begin:
+            sd[k] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        t = torch.frombuffer(mm, dtype=dtype, count=(end - begin) // torch.empty((), dtype=dtype).element_size(), offset=data_start + begin)
+        sd[k] = t.reshape(info["shape"])
+    return sd
+
 def set_attr(obj, attr, value):
     attrs = attr.split(".")
     for name in attrs[:-1]:
@@ -5,15 +5,51 @@ import threading
 import heapq
 import traceback
 import inspect
+import concurrent.futures
+import hashlib
+import json
+import math
+from collections import OrderedDict
 from typing import List, Literal, NamedTuple, Optional
 
 import torch
 import nodes
+import folder_paths
 
 import comfy.model_management
+from comfy.cli_args import args
+
+RESOURCE_CLASSES = ("accelerator", "cpu", "io")
+
+class InputTypesCache:
+    """
+    INPUT_TYPES() of the node classes. For loaders it lists the model folders and for
+    LoadImage the input folder, so calling it for every node that is validated and run
+    stats whole directory trees. The results are kept until folder_paths reports that
+    those folders changed, which refresh() checks when a prompt is validated and again
+    when it runs, since files may be added while it waits in the queue.
+    """
+    def __init__(self):
+        self.generation = None
+        self.input_types = {}
+
+    def refresh(self):
+        generation = folder_paths.get_folder_index_generation()
+        if generation != self.generation:
+            self.input_types = {}
+            self.generation = generation
+
+    def get(self, class_def):
+        input_types = self.input_types.get(class_def)
+        if input_types is None:
+            input_types = class_def.INPUT_TYPES()
+            self.input_types[class_def] = input_types
+        return input_types
+
+input_types_cache = InputTypesCache()
 
 def get_input_data(inputs, class_def, unique_id, outputs={}, prompt={}, extra_data={}):
-    valid_inputs = class_def.INPUT_TYPES()
+    valid_inputs = input_types_cache.get(class_def)
     input_data_all = {}
     for x in inputs:
         input_data = inputs[x]
@@ -117,31 +153,43 @@ def format_value(x):
     else:
         return str(x)
 
-def recursive_execute(server, prompt, outputs, current_item, extra_data, executed, prompt_id, outputs_ui, object_storage):
-    unique_id = current_item
+def execution_error_details(unique_id, ex, input_data_all, outputs):
+    typ, _, tb = sys.exc_info()
+    exception_type = full_type_name(typ)
+    input_data_formatted = {}
+    if input_data_all is not None:
+        input_data_formatted = {}
+        for name, inputs in input_data_all.items():
+            input_data_formatted[name] = [format_value(x) for x in inputs]
+
+    output_data_formatted = {}
+    for node_id, node_outputs in list(outputs.items()):
+        output_data_formatted[node_id] = [[format_value(x) for x in l] for l in node_outputs]
+
+    return {
+        "node_id": unique_id,
+        "exception_message": str(ex),
+        "exception_type": exception_type,
+        "traceback": traceback.format_tb(tb),
+        "current_inputs": input_data_formatted,
+        "current_outputs": output_data_formatted
+    }
+
+def execute_node(server, prompt, outputs, unique_id, extra_data, executed, prompt_id, outputs_ui, object_storage, update_last_node=True):
+    # Runs a single node whose inputs are all in outputs already
+    # update_last_node: whether progress reports (which use server.last_node_id) come from this node
     inputs = prompt[unique_id]['inputs']
     class_type = prompt[unique_id]['class_type']
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
     if unique_id in outputs:
         return (True, None, None)
 
-    for x in inputs:
-        input_data = inputs[x]
-
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                result = recursive_execute(server, prompt, outputs, input_unique_id, extra_data, executed, prompt_id, outputs_ui, object_storage)
-                if result[0] is not True:
-                    # Another node failed further upstream
-                    return result
-
     input_data_all = None
     try:
         input_data_all = get_input_data(inputs, class_def, unique_id, outputs, prompt, extra_data)
         if server.client_id is not None:
-            server.last_node_id = unique_id
+            if update_last_node:
+                server.last_node_id = unique_id
             server.send_sync("executing", { "node": unique_id, "prompt_id": prompt_id }, server.client_id)
 
         obj = object_storage.get((unique_id, class_type), None)
@@ -165,108 +213,347 @@ def recursive_execute(server, prompt, outputs, current_item, extra_data, execute
 
         return (False, error_details, iex)
     except Exception as ex:
-        typ, _, tb = sys.exc_info()
-        exception_type = full_type_name(typ)
-        input_data_formatted = {}
-        if input_data_all is not None:
-            input_data_formatted = {}
-            for name, inputs in input_data_all.items():
-                input_data_formatted[name] = [format_value(x) for x in inputs]
-
-        output_data_formatted = {}
-        for node_id, node_outputs in outputs.items():
-            output_data_formatted[node_id] = [[format_value(x) for x in l] for l in node_outputs]
-
         logging.error("!!! Exception during processing !!!")
         logging.error(traceback.format_exc())
 
-        error_details = {
-            "node_id": unique_id,
-            "exception_message": str(ex),
-            "exception_type": exception_type,
-            "traceback": traceback.format_tb(tb),
-            "current_inputs": input_data_formatted,
-            "current_outputs": output_data_formatted
-        }
+        error_details = execution_error_details(unique_id, ex, input_data_all, outputs)
         return (False, error_details, ex)
 
     executed.add(unique_id)
 
     return (True, None, None)
 
-def recursive_will_execute(prompt, outputs, current_item):
-    unique_id = current_item
-    inputs = prompt[unique_id]['inputs']
-    will_execute = []
-    if unique_id in outputs:
-        return []
-
-    for x in inputs:
-        input_data = inputs[x]
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                will_execute += recursive_will_execute(prompt, outputs, input_unique_id)
-
-    return will_execute + [unique_id]
-
-def recursive_output_delete_if_changed(prompt, old_prompt, outputs, current_item):
-    unique_id = current_item
-    inputs = prompt[unique_id]['inputs']
-    class_type = prompt[unique_id]['class_type']
-    class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+class ExecutionGraph:
+    """
+    The part of a prompt that has to run to produce a set of outputs, compiled into an
+    explicit DAG. Nodes whose outputs are cached are left out, as are links to them.
+
+    Nodes are handed out by an in-degree driven ready queue: a node becomes ready once
+    every node it reads from has run, and the ready node with the lowest priority runs
+    first. priority() is the scheduling policy. By default it is the position of the
+    node in a depth-first walk of the outputs' inputs, so each output's inputs run in
+    input order, and the outputs that need the fewest nodes go first.
+
+    With ordered_outputs, output nodes also wait for the output nodes before them, so
+    that when nodes run in parallel their side effects (like the numbering of saved
+    files) happen in the same order as when they run one at a time.
+    """
+    def __init__(self, prompt, execute_outputs, cached, ordered_outputs=False):
+        self.prompt = prompt
+        self.upstream = {}  # node id -> set of uncached node ids it reads from
+        self.downstream = {}  # node id -> list of node ids reading from it
+        self.order = {}  # node id -> position in the depth-first walk
+
+        for output_id in execute_outputs:
+            if output_id not in cached:
+                self.add_subgraph(output_id, cached)
+
+        # Outputs that need the fewest nodes go first, then by node id
+        sizes = {o: len(self.subgraph(o)) for o in execute_outputs if o in self.upstream}
+        for output_id in sorted(sizes, key=lambda o: (sizes[o], o)):
+            self.number_subgraph(output_id)
+        if ordered_outputs:
+            self.order_outputs()
+
+        self.in_degree = {x: len(deps) for x, deps in self.upstream.items()}
+        self.ready = [(self.priority(x), x) for x, degree in self.in_degree.items() if degree == 0]
+        heapq.heapify(self.ready)
+        self.done = 0
+
+    def linked_inputs(self, unique_id):
+        for x, input_data in self.prompt[unique_id]['inputs'].items():
+            if isinstance(input_data, list):
+                yield input_data[0]
+
+    def add_subgraph(self, output_id, cached):
+        stack = [output_id]
+        while len(stack) > 0:
+            unique_id = stack.pop()
+            if unique_id in self.upstream:
+                continue
+            deps = set()
+            for input_unique_id in self.linked_inputs(unique_id):
+                if input_unique_id not in cached:
+                    deps.add(input_unique_id)
+                    if input_unique_id not in self.upstream:
+                        stack.append(input_unique_id)
+            self.upstream[unique_id] = deps
+            self.downstream.setdefault(unique_id, [])
+            for input_unique_id in deps:
+                self.downstream.setdefault(input_unique_id, []).append(unique_id)
+
+    def subgraph(self, output_id):
+        seen = {output_id}
+        stack = [output_id]
+        while len(stack) > 0:
+            for input_unique_id in self.upstream[stack.pop()]:
+                if input_unique_id not in seen:
+                    seen.add(input_unique_id)
+                    stack.append(input_unique_id)
+        return seen
+
+    def number_subgraph(self, output_id):
+        # Iterative post-order walk: a node is numbered after all of its inputs, in input order
+        if output_id in self.order:
+            return
+        visiting = {output_id}
+        stack = [(output_id, iter(self.linked_inputs(output_id)))]
+        while len(stack) > 0:
+            unique_id, inputs = stack[-1]
+            for input_unique_id in inputs:
+                if input_unique_id not in self.upstream or input_unique_id in self.order:
+                    continue
+                if input_unique_id in visiting:
+                    raise ValueError(f"Dependency cycle through node {input_unique_id}")
+                visiting.add(input_unique_id)
+                stack.append((input_unique_id, iter(self.linked_inputs(input_unique_id))))
+                break
+            else:
+                stack.pop()
+                visiting.discard(unique_id)
+                self.order[unique_id] = len(self.order)
+
+    def order_outputs(self):
+        output_nodes = [x for x in self.upstream if getattr(self.class_def(x), 'OUTPUT_NODE', False) == True]
+        output_nodes.sort(key=self.priority)
+        for before, after in zip(output_nodes, output_nodes[1:]):
+            if before not in self.upstream[after]:
+                self.upstream[after].add(before)
+                self.downstream[before].append(after)
+
+    def class_def(self, unique_id):
+        return nodes.NODE_CLASS_MAPPINGS[self.prompt[unique_id]['class_type']]
+
+    def priority(self, unique_id):
+        return self.order[unique_id]
+
+    def resource_class(self, unique_id):
+        resource = getattr(self.class_def(unique_id), 'RESOURCE_CLASS', "accelerator")
+        if callable(resource):
+            resource = resource()
+        if resource not in RESOURCE_CLASSES:
+            return "accelerator"
+        return resource
+
+    def __len__(self):
+        return len(self.upstream)
+
+    def is_finished(self):
+        return self.done == len(self.upstream)
+
+    def next_ready(self):
+        """
+        Returns the next node that can run, or None if none can until more nodes finish.
+        """
+        if len(self.ready) == 0:
+            return None
+        return heapq.heappop(self.ready)[1]
+
+    def finish(self, unique_id):
+        """
+        Marks a node as run and queues the nodes that were only waiting for it.
+        """
+        self.done += 1
+        for dependent in self.downstream[unique_id]:
+            self.in_degree[dependent] -= 1
+            if self.in_degree[dependent] == 0:
+                heapq.heappush(self.ready, (self.priority(dependent), dependent))
+
+def output_size(value):
+    #bytes of the tensors in a node output, counting shared tensors once, and the weights of the
+    #models in it (MODEL, CLIP, VAE) by module id, so clones sharing a model can be counted once
+    size = 0
+    modules = {}
+    seen = set()
+    stack = [value]
+    while len(stack) > 0:
+        v = stack.pop()
+        if id(v) in seen:
+            continue
+        seen.add(id(v))
+        if isinstance(v, torch.Tensor):
+            size += v.nelement() * v.element_size()
+        elif isinstance(v, (list, tuple)):
+            stack.extend(v)
+        elif isinstance(v, dict):
+            stack.extend(v.values())
+        elif isinstance(v, torch.nn.Module):
+            if id(v) not in modules:
+                modules[id(v)] = comfy.model_management.module_size(v)
+        elif hasattr(v, "model_size") and hasattr(v, "model"): #ModelPatcher
+            if id(v.model) not in modules:
+                modules[id(v.model)] = v.model_size()
+        elif hasattr(v, "patcher"): #CLIP
+            stack.append(v.patcher)
+        elif hasattr(v, "first_stage_model"): #VAE
+            stack.append(v.first_stage_model)
+    return size, modules
+
+def has_nan(value):
+    #IS_CHANGED returns NaN to mean "always changed"
+    if isinstance(value, float):
+        return math.isnan(value)
+    if isinstance(value, (list, tuple)):
+        return any(has_nan(v) for v in value)
+    return False
+
+class OutputCache:
+    """
+    Node outputs of earlier prompts, addressed by what produced them rather than by node id.
+
+    The key of a node is a hash of its class_type, its literal inputs, the keys of the
+    nodes it is linked to and its IS_CHANGED value, so the same subgraph is found again
+    in any later prompt, whatever its node ids. Entries are evicted least recently used
+    first once there are more than max_entries or they take more than max_bytes, counting
+    their tensors and the weights of the models they hold (a model shared by several
+    entries, like a checkpoint and its LoRA clones, is counted once). The outputs of the
+    latest prompt are never evicted, so re-running it after a small edit only runs what
+    changed.
+    """
+    def __init__(self, max_entries=256, max_bytes=8192 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (outputs, ui, tensor bytes, {module id: bytes})
+        self.module_refs = {}  # module id -> [entries holding it, bytes]
+        self.bytes = 0
+        self.pinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def node_key(self, prompt, unique_id, keys, outputs):
+        # None when the node can't be cached, which makes every node downstream of it uncacheable too
+        node = prompt[unique_id]
+        class_def = nodes.NODE_CLASS_MAPPINGS[node['class_type']]
+        literal_inputs = {}
+        linked_inputs = {}
+        for x, input_data in node['inputs'].items():
+            if isinstance(input_data, list):
+                input_key = keys.get(input_data[0])
+                if input_key is None:
+                    return None
+                linked_inputs[x] = [input_key, input_data[1]]
+            else:
+                literal_inputs[x] = input_data
 
-    is_changed_old = ''
-    is_changed = ''
-    to_delete = False
-    if hasattr(class_def, 'IS_CHANGED'):
-        if unique_id in old_prompt and 'is_changed' in old_prompt[unique_id]:
-            is_changed_old = old_prompt[unique_id]['is_changed']
-        if 'is_changed' not in prompt[unique_id]:
-            input_data_all = get_input_data(inputs, class_def, unique_id, outputs)
-            if input_data_all is not None:
+        is_changed = None
+        if hasattr(class_def, 'IS_CHANGED'):
+            if 'is_changed' not in node:
+                input_data_all = get_input_data(node['inputs'], class_def, unique_id, outputs)
                 try:
-                    #is_changed = class_def.IS_CHANGED(**input_data_all)
-                    is_changed = map_node_over_list(class_def, input_data_all, "IS_CHANGED")
-                    prompt[unique_id]['is_changed'] = is_changed
+                    node['is_changed'] = map_node_over_list(class_def, input_data_all, "IS_CHANGED")
                 except:
-                    to_delete = True
-        else:
-            is_changed = prompt[unique_id]['is_changed']
-
-    if unique_id not in outputs:
-        return True
-
-    if not to_delete:
-        if is_changed != is_changed_old:
-            to_delete = True
-        elif unique_id not in old_prompt:
-            to_delete = True
-        elif inputs == old_prompt[unique_id]['inputs']:
-            for x in inputs:
-                input_data = inputs[x]
-
-                if isinstance(input_data, list):
-                    input_unique_id = input_data[0]
-                    output_index = input_data[1]
-                    if input_unique_id in outputs:
-                        to_delete = recursive_output_delete_if_changed(prompt, old_prompt, outputs, input_unique_id)
-                    else:
-                        to_delete = True
-                    if to_delete:
-                        break
-        else:
-            to_delete = True
-
-    if to_delete:
-        d = outputs.pop(unique_id)
-        del d
-    return to_delete
+                    return None
+            is_changed = node['is_changed']
+            if has_nan(is_changed):
+                return None
+
+        node_id = None
+        hidden = input_types_cache.get(class_def).get("hidden", {})
+        if "UNIQUE_ID" in hidden.values():
+            node_id = unique_id
+        content = [node['class_type'], literal_inputs, linked_inputs, is_changed, node_id]
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=repr).encode()).hexdigest()
+
+    def load_prompt(self, prompt, outputs, outputs_ui):
+        """
+        Computes the key of every node of the prompt and fills outputs and outputs_ui with
+        the cached ones. Nodes are keyed inputs first, so that IS_CHANGED sees the cached
+        outputs of the nodes it reads from. Returns the keys by node id.
+        """
+        keys = {}
+        for start in prompt:
+            stack = [start]
+            entered = set()
+            while len(stack) > 0:
+                unique_id = stack[-1]
+                if unique_id in keys:
+                    stack.pop()
+                    continue
+                pending = []
+                for input_data in prompt[unique_id]['inputs'].values():
+                    if isinstance(input_data, list) and input_data[0] in prompt and input_data[0] not in keys:
+                        pending.append(input_data[0])
+                if len(pending) > 0 and unique_id not in entered:
+                    entered.add(unique_id)
+                    stack.extend(pending)
+                    continue
+                stack.pop()
+                # still pending here means a dependency cycle, which leaves the key missing
+                key = None if len(pending) > 0 else self.node_key(prompt, unique_id, keys, outputs)
+                keys[unique_id] = key
+                entry = self.get(key)
+                if entry is not None:
+                    outputs[unique_id] = entry[0]
+                    if entry[1] is not None:
+                        outputs_ui[unique_id] = entry[1]
+        return keys
+
+    def get(self, key):
+        if key is None or key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, output, ui=None):
+        if key is None:
+            return
+        if key in self.entries:
+            self.remove(key)
+        size, modules = output_size(output)
+        self.entries[key] = (output, ui, size, modules)
+        self.bytes += size
+        for module_id, module_bytes in modules.items():
+            ref = self.module_refs.setdefault(module_id, [0, module_bytes])
+            if ref[0] == 0:
+                self.bytes += module_bytes
+            ref[0] += 1
+        self.evict()
+
+    def remove(self, key):
+        output, ui, size, modules = self.entries.pop(key)
+        self.bytes -= size
+        for module_id in modules:
+            ref = self.module_refs[module_id]
+            ref[0] -= 1
+            if ref[0] == 0:
+                self.bytes -= ref[1]
+                del self.module_refs[module_id]
+
+    def pin(self, keys):
+        self.pinned = set(k for k in keys if k is not None)
+        self.evict()
+
+    def evict(self):
+        for key in list(self.entries.keys()):
+            if len(self.entries) <= self.max_entries and self.bytes <= self.max_bytes:
+                break
+            if key in self.pinned:
+                continue
+            self.remove(key)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.module_refs = {}
+        self.bytes = 0
+        self.pinned = set()
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
 
 class PromptExecutor:
     def __init__(self, server):
         self.server = server
+        self.pools = None
         self.reset()
 
     def reset(self):
@@ -275,7 +562,7 @@ class PromptExecutor:
         self.outputs_ui = {}
         self.status_messages = []
         self.success = True
-        self.old_prompt = {}
+        self.cache = OutputCache(max_entries=max(0, args.cache_max_entries), max_bytes=args.cache_ram_mb * 1024 * 1024)
 
     def add_message(self, event, data, broadcast: bool):
         self.status_messages.append((event, data))
@@ -316,13 +603,73 @@ class PromptExecutor:
         for o in self.outputs:
             if (o not in current_outputs) and (o not in executed):
                 to_delete += [o]
-                if o in self.old_prompt:
-                    d = self.old_prompt.pop(o)
-                    del d
         for o in to_delete:
             d = self.outputs.pop(o)
             del d
 
+    def get_pools(self):
+        if self.pools is None:
+            workers = {
+                "accelerator": 1,
+                "cpu": max(1, args.parallel_cpu_workers),
+                "io": max(1, args.parallel_io_workers),
+            }
+            self.pools = {}
+            for resource in RESOURCE_CLASSES:
+                pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers[resource], thread_name_prefix=f"comfy-{resource}")
+                self.pools[resource] = (pool, workers[resource])
+        return self.pools
+
+    def execute_node_in_pool(self, resource, prompt, unique_id, extra_data, executed, prompt_id):
+        #inference mode is per thread
+        #only the single accelerator thread runs the nodes that report progress (samplers), nodes on the
+        #other pools would make progress point at whichever node started last
+        with torch.inference_mode():
+            return execute_node(self.server, prompt, self.outputs, unique_id, extra_data, executed, prompt_id, self.outputs_ui, self.object_storage, update_last_node=(resource == "accelerator"))
+
+    def execute_parallel(self, graph, prompt, prompt_id, extra_data, executed):
+        """
+        Runs the graph with every node on the thread pool of its resource class, as soon
+        as its inputs are done and a thread of its class is free. Ready nodes of a class
+        start in priority order. After a node fails no more nodes are started, the ones
+        still running are waited for, and the failure is returned like execute_node does.
+        """
+        pools = self.get_pools()
+        ready = {resource: [] for resource in pools}
+        busy = {resource: 0 for resource in pools}
+        running = {}
+        failure = None
+        while True:
+            unique_id = graph.next_ready()
+            while unique_id is not None:
+                heapq.heappush(ready[graph.resource_class(unique_id)], (graph.priority(unique_id), unique_id))
+                unique_id = graph.next_ready()
+
+            if failure is None:
+                for resource, (pool, workers) in pools.items():
+                    while busy[resource] < workers and len(ready[resource]) > 0:
+                        unique_id = heapq.heappop(ready[resource])[1]
+                        future = pool.submit(self.execute_node_in_pool, resource, prompt, unique_id, extra_data, executed, prompt_id)
+                        running[future] = (resource, unique_id)
+                        busy[resource] += 1
+
+            if len(running) == 0:
+                break
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                resource, unique_id = running.pop(future)
+                busy[resource] -= 1
+                result = future.result()
+                if result[0] is not True:
+                    if failure is None:
+                        failure = result
+                else:
+                    graph.finish(unique_id)
+
+        if failure is not None:
+            return failure
+        return (True, None, None)
+
     def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
         nodes.interrupt_processing(False)
 
@@ -333,16 +680,9 @@ class PromptExecutor:
 
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
+        input_types_cache.refresh()
 
         with torch.inference_mode():
-            #delete cached outputs if nodes don't exist for them
-            to_delete = []
-            for o in self.outputs:
-                if o not in prompt:
-                    to_delete += [o]
-            for o in to_delete:
-                d = self.outputs.pop(o)
-                del d
             to_delete = []
             for o in self.object_storage:
                 if o[0] not in prompt:
@@ -355,41 +695,48 @@ class PromptExecutor:
                 d = self.object_storage.pop(o)
                 del d
 
-            for x in prompt:
-                recursive_output_delete_if_changed(prompt, self.old_prompt, self.outputs, x)
-
+            #outputs of earlier prompts are only kept in the cache
+            self.outputs = {}
+            self.outputs_ui = {}
+            cache_keys = self.cache.load_prompt(prompt, self.outputs, self.outputs_ui)
+            #what this prompt uses or produces is kept over the outputs of earlier ones
+            self.cache.pin(cache_keys.values())
             current_outputs = set(self.outputs.keys())
-            for x in list(self.outputs_ui.keys()):
-                if x not in current_outputs:
-                    d = self.outputs_ui.pop(x)
-                    del d
 
             comfy.model_management.cleanup_models()
             self.add_message("execution_cached",
                           { "nodes": list(current_outputs) , "prompt_id": prompt_id},
                           broadcast=False)
             executed = set()
-            output_node_id = None
-            to_execute = []
-
-            for node_id in list(execute_outputs):
-                to_execute += [(0, node_id)]
-
-            while len(to_execute) > 0:
-                #always execute the output that depends on the least amount of unexecuted nodes first
-                to_execute = sorted(list(map(lambda a: (len(recursive_will_execute(prompt, self.outputs, a[-1])), a[-1]), to_execute)))
-                output_node_id = to_execute.pop(0)[-1]
-
-                # This call shouldn't raise anything if there's an error deep in
-                # the actual SD code, instead it will report the node where the
-                # error was raised
-                self.success, error, ex = recursive_execute(self.server, prompt, self.outputs, output_node_id, extra_data, executed, prompt_id, self.outputs_ui, self.object_storage)
+            try:
+                graph = ExecutionGraph(prompt, execute_outputs, self.outputs, ordered_outputs=args.parallel_execution)
+            except Exception as ex:
+                # validate_prompt rejects cycles, so this only happens for prompts that skipped it
+                self.success = False
+                error = execution_error_details(execute_outputs[0], ex, None, self.outputs)
+                self.handle_execution_error(prompt_id, prompt, current_outputs, executed, error, ex)
+                graph = None
+
+            if graph is not None and args.parallel_execution:
+                self.success, error, ex = self.execute_parallel(graph, prompt, prompt_id, extra_data, executed)
                 if self.success is not True:
                     self.handle_execution_error(prompt_id, prompt, current_outputs, executed, error, ex)
-                    break
+            elif graph is not None:
+                while not graph.is_finished():
+                    unique_id = graph.next_ready()
+
+                    # This call shouldn't raise anything if there's an error deep in
+                    # the actual SD code, instead it will report the node where the
+                    # error was raised
+                    self.success, error, ex = execute_node(self.server, prompt, self.outputs, unique_id, extra_data, executed, prompt_id, self.outputs_ui, self.object_storage)
+                    if self.success is not True:
+                        self.handle_execution_error(prompt_id, prompt, current_outputs, executed, error, ex)
+                        break
+                    graph.finish(unique_id)
 
             for x in executed:
-                self.old_prompt[x] = copy.deepcopy(prompt[x])
+                self.cache.put(cache_keys.get(x), self.outputs[x], self.outputs_ui.get(x))
+            self.cache.pin(cache_keys[x] for x in self.outputs if x in cache_keys)
             self.server.last_node_id = None
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
@@ -405,7 +752,7 @@ def validate_inputs(prompt, item, validated):
     class_type = prompt[unique_id]['class_type']
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
+    class_inputs = input_types_cache.get(obj_class)
     required_inputs = class_inputs['required']
 
     errors = []
@@ -615,6 +962,7 @@ def full_type_name(klass):
     return module + '.' + klass.__qualname__
 
 def validate_prompt(prompt):
+    input_types_cache.refresh()
     outputs = set()
     for x in prompt:
         class_ = nodes.NODE_CLASS_MAPPINGS[prompt[x]['class_type']]
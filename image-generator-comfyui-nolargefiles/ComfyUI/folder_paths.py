@@ -40,6 +40,10 @@ user_directory = os.path.join(os.path.dirname(os.path.realpath(__file__)), "user
 
 filename_list_cache = {}
 
+#goes up whenever a model folder or the input folder may have changed, see get_folder_index_generation()
+folder_index_generation = 0
+folder_index_state = None
+
 if not os.path.exists(input_directory):
     try:
         os.makedirs(input_directory)
@@ -222,6 +226,43 @@ def get_filename_list(folder_name):
         filename_list_cache[folder_name] = out
     return list(out[0])
 
+def folder_index_changed():
+    #for changes that folder modification times might miss, like two uploads within their resolution
+    global folder_index_generation
+    folder_index_generation += 1
+
+def get_folder_index_generation():
+    """
+    Returns a number that changes whenever the model folders, the files listed in them or
+    the input folder may have changed, so that anything built from them, like the
+    INPUT_TYPES of loaders and LoadImage, can be kept until then. Every call checks which
+    configured folders exist and the modification times of the indexed ones, so call it
+    only where the result is about to be used, like validating and running a prompt.
+    """
+    global folder_index_generation
+    global folder_index_state
+    state = [input_directory]
+    for folder_name in sorted(folder_names_and_paths):
+        folders = folder_names_and_paths[folder_name]
+        state.append((folder_name, tuple(folders[0]), tuple(sorted(folders[1]))))
+        #a folder created after it was indexed (e.g. models/loras) isn't in the filename list cache yet
+        state.append(tuple(os.path.isdir(x) for x in folders[0]))
+    for folder_name in sorted(filename_list_cache):
+        for folder in sorted(filename_list_cache[folder_name][1]):
+            try:
+                state.append((folder, os.path.getmtime(folder)))
+            except OSError:
+                state.append((folder, None))
+    try:
+        state.append(os.path.getmtime(input_directory))
+    except OSError:
+        state.append(None)
+
+    if state != folder_index_state:
+        folder_index_state = state
+        folder_index_generation += 1
+    return folder_index_generation
+
 def get_save_image_path(filename_prefix, output_dir, image_width=0, image_height=0):
     def map_filename(filename):
         prefix_len = len(os.path.basename(filename_prefix))
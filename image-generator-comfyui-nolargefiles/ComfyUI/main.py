@@ -122,6 +122,8 @@ def prompt_worker(q, server):
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
             print("Prompt executed in {:.2f} seconds".format(execution_time))
+            cache_stats = e.cache.stats()
+            print("Output cache: {} entries, {:.1f} MB, {} hits, {} misses".format(cache_stats["entries"], cache_stats["bytes"] / (1024 * 1024), cache_stats["hits"], cache_stats["misses"]))
 
         flags = q.get_flags()
         free_memory = flags.get("free_memory", False)
@@ -21,6 +21,7 @@ import comfy.diffusers_load
 import comfy.samplers
 import comfy.sample
 import comfy.sd
+import comfy.lora
 import comfy.utils
 import comfy.controlnet
 
@@ -42,12 +43,22 @@ def interrupt_processing(value=True):
 
 MAX_RESOLUTION=8192
 
+#Resource classes for --parallel-execution: nodes set RESOURCE_CLASS to "accelerator" (the default,
+#one node at a time), "cpu" or "io", or to a function returning one of them.
+def text_encoder_resource_class():
+    #a text encoder on the cpu can run while the gpu samples
+    text_encoder_device = comfy.model_management.text_encoder_device()
+    if comfy.model_management.is_device_cpu(text_encoder_device) and not comfy.model_management.is_device_cpu(comfy.model_management.get_torch_device()):
+        return "cpu"
+    return "accelerator"
+
 class CLIPTextEncode:
     @classmethod
     def INPUT_TYPES(s):
         return {"required": {"text": ("STRING", {"multiline": True}), "clip": ("CLIP", )}}
     RETURN_TYPES = ("CONDITIONING",)
     FUNCTION = "encode"
+    RESOURCE_CLASS = text_encoder_resource_class
 
     CATEGORY = "conditioning"
 
@@ -611,9 +622,6 @@ class CLIPSetLastLayer:
         return (clip,)
 
 class LoraLoader:
-    def __init__(self):
-        self.loaded_lora = None
-
     @classmethod
     def INPUT_TYPES(s):
         return {"required": { "model": ("MODEL",),
@@ -632,18 +640,7 @@ class LoraLoader:
             return (model, clip)
 
         lora_path = folder_paths.get_full_path("loras", lora_name)
-        lora = None
-        if self.loaded_lora is not None:
-            if self.loaded_lora[0] == lora_path:
-                lora = self.loaded_lora[1]
-            else:
-                temp = self.loaded_lora
-                self.loaded_lora = None
-                del temp
-
-        if lora is None:
-            lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
-            self.loaded_lora = (lora_path, lora)
+        lora = comfy.lora.get_lora_cache().load(lora_path)
 
         model_lora, clip_lora = comfy.sd.load_lora_for_models(model, clip, lora, strength_model, strength_clip)
         return (model_lora, clip_lora)
@@ -1332,6 +1329,8 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
     latent_image = latent["samples"]
     if disable_noise:
         noise = torch.zeros(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
+    elif "batch_seeds" in latent:
+        noise = comfy.sample.prepare_noise_per_seed(latent_image, latent["batch_seeds"])
     else:
         batch_inds = latent["batch_index"] if "batch_index" in latent else None
         noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
@@ -1425,6 +1424,7 @@ class SaveImage:
 
     RETURN_TYPES = ()
     FUNCTION = "save_images"
+    RESOURCE_CLASS = "io"
 
     OUTPUT_NODE = True
 
@@ -1484,6 +1484,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    RESOURCE_CLASS = "io"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
         img = Image.open(image_path)
@@ -1543,6 +1544,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    RESOURCE_CLASS = "io"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = Image.open(image_path)
@@ -197,6 +197,7 @@ class PromptServer():
                 else:
                     with open(filepath, "wb") as f:
                         f.write(image.file.read())
+                folder_paths.folder_index_changed()
 
                 return web.json_response({"name" : filename, "subfolder": subfolder, "type": image_upload_type})
             else:
@@ -0,0 +1,67 @@
+"""
+Measures how long the generation scripts take to get ready to render.
+
+Each path is timed in a fresh interpreter, best of --runs:
+
+  torch   import torch alone, the floor every path pays
+  entry   comfy_entry: the node classes the scripts use, without main.py
+  legacy  what the scripts did before: import main (prestartup scripts, server,
+          executor), then nodes
+
+Exits with status 1 if the entry path takes more than --budget seconds on top of
+importing torch, so it can guard against new heavy imports creeping in.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SNIPPETS = {
+    "torch": "import torch",
+    "entry": "import torch\nfrom comfy_entry import CheckpointLoaderSimple, LoraLoader, CLIPTextEncode, EmptyLatentImage, KSampler, VAEDecode, SaveImage",
+    "legacy": "import sys, comfy_entry\nsys.path.append(comfy_entry.find_comfyui_root())\nimport torch\nimport main\nimport nodes",
+}
+
+
+def time_import(snippet, extra_args):
+    """
+    Returns the wall time in seconds of running snippet in a new interpreter.
+    """
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-s", "-c", snippet] + extra_args,
+        cwd=HERE,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="runs per path, the fastest counts")
+    parser.add_argument("--budget", type=float, default=2.0, help="allowed seconds on top of importing torch")
+    parser.add_argument("--skip-legacy", action="store_true", help="don't time the old import path")
+    args, extra_args = parser.parse_known_args()
+
+    names = ["torch", "entry"] if args.skip_legacy else ["torch", "entry", "legacy"]
+    best = {}
+    for name in names:
+        # ComfyUI's argument parser reads the leftover arguments, e.g. --cpu
+        best[name] = min(time_import(SNIPPETS[name], extra_args) for _ in range(args.runs))
+        print(f"{name:>6}: {best[name]:.2f}s")
+
+    overhead = best["entry"] - best["torch"]
+    print(f"entry overhead over torch: {overhead:.2f}s (budget {args.budget:.2f}s)")
+    if "legacy" in best:
+        print(f"saved against legacy: {best['legacy'] - best['entry']:.2f}s")
+    if overhead > args.budget:
+        print("Import time budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Manifest-driven, resumable batch builder for portraits and backgrounds.
+
+Every asset in the manifest is described by everything that decides its pixels
+(checkpoint, LoRAs, prompts, seed, steps, cfg, sampler and size), and the hash of
+that description is its address in the output store: <store>/<hash[:2]>/<hash>.png.
+Assets whose file already exists are skipped, so a run that crashed or was stopped
+picks up where it left off, and changing one prompt only re-renders what it affects.
+Files are written atomically, and <store>/index.json maps every asset's usual file
+prefix (e.g. "Sorceress_happy", "bg_glade") to its path in the store.
+
+Assets are rendered grouped by checkpoint and LoRA, so each LoRA is patched once.
+Seeds that the manifest leaves out are derived from the asset name, so they are the
+same on every run.
+
+Run command (any extra arguments are passed on to ComfyUI):
+    .\\python_embeded\\python.exe -s build_assets.py assets_manifest.json --store asset_store
+
+Manifest (JSON, or YAML for .yaml/.yml files), see assets_manifest.json:
+    {
+      "portraits": {
+        "checkpoint": "irismix_v90.safetensors", "steps": 20, "cfg": 8, "width": 512, "height": 512,
+        "expressions": ["neutral", "happy"],            (optional, default all)
+        "characters": {
+          "Sorceress": {"prompt": ["<positive>", "<negative>"], "seed": 1234},
+          "Explorer": ["<positive>", "<negative>"]
+        }
+      },
+      "backgrounds": {
+        "checkpoint": "...", "lora": "...", "steps": 20, "cfg": 8, "width": 1920, "height": 1200,
+        "backgrounds": {"glade": ["<positive>", "<negative>"]}
+      }
+    }
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+builder_parser = argparse.ArgumentParser()
+builder_parser.add_argument("manifest", type=str, help="JSON or YAML manifest of the assets to build.")
+builder_parser.add_argument("--store", type=str, default="asset_store", help="Content-addressed output directory.")
+builder_parser.add_argument("--dry-run", action="store_true", help="Only report which assets would be built.")
+builder_parser.add_argument("--shard", type=str, default=None, metavar="I/K", help="Only build every K-th asset starting at I and report to <store>/shards/ (used by shard_build.py).")
+builder_parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads for this process.")
+builder_args, comfy_argv = builder_parser.parse_known_args()
+# Everything we don't understand is for ComfyUI's own argument parser, which runs on import
+sys.argv = sys.argv[:1] + comfy_argv
+
+import numpy as np
+import torch
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+import generate_portraits
+from generate_portraits import (
+    CLIPTextEncode,
+    EmptyLatentImage,
+    KSampler,
+    LoraLoader,
+    VAEDecode,
+    get_value_at_index,
+    load_checkpoint,
+)
+
+# Settings the scripts use when the manifest doesn't say
+SAMPLER_NAME = "euler"
+SCHEDULER = "normal"
+PORTRAIT_DEFAULTS = {"steps": 20, "cfg": 8, "width": 512, "height": 512}
+BACKGROUND_DEFAULTS = {"steps": 20, "cfg": 8, "width": 1920, "height": 1200}
+
+# Fields of an asset spec that decide its pixels; everything else is bookkeeping
+HASHED_FIELDS = (
+    "checkpoint", "loras", "positive", "negative", "seed", "steps", "cfg",
+    "sampler_name", "scheduler", "width", "height",
+)
+
+
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def default_seed(kind, name):
+    """
+    A seed that only depends on the asset name, so unchanged assets hash the same on every run.
+    """
+    return int(hashlib.sha256(f"{kind}:{name}".encode()).hexdigest()[:15], 16)
+
+
+def parse_entry(kind, name, entry):
+    """
+    Accepts either [positive, negative] as in the scripts or {"prompt": [...], "seed": N}.
+    """
+    if isinstance(entry, dict):
+        return entry["prompt"], entry.get("seed", default_seed(kind, name))
+    return entry, default_seed(kind, name)
+
+
+def asset_hash(spec):
+    content = {field: spec[field] for field in HASHED_FIELDS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def plan_assets(manifest):
+    """
+    Expands the manifest into one spec per image, grouped by checkpoint and LoRA.
+    """
+    specs = []
+
+    portraits = manifest.get("portraits")
+    if portraits:
+        settings = dict(PORTRAIT_DEFAULTS, **{k: v for k, v in portraits.items() if k in PORTRAIT_DEFAULTS})
+        expressions = [generate_portraits.NEUTRAL_EXPRESSION] + generate_portraits.EXPRESSION_LORAS
+        wanted = portraits.get("expressions")
+        if wanted is not None:
+            expressions = [e for e in expressions if e[2] in wanted]
+        for lora_name, lora_prompt, expression_name in expressions:
+            for name, entry in portraits["characters"].items():
+                description, seed = parse_entry("portrait", name, entry)
+                specs.append(dict(
+                    settings,
+                    prefix=name + "_" + expression_name,
+                    checkpoint=portraits["checkpoint"],
+                    loras=[] if lora_name is None else [[lora_name, 1.0]],
+                    positive="face front, " + lora_prompt + description[0],
+                    negative="background, text, hand" + description[1],
+                    seed=seed,
+                    sampler_name=SAMPLER_NAME,
+                    scheduler=SCHEDULER,
+                ))
+
+    backgrounds = manifest.get("backgrounds")
+    if backgrounds:
+        settings = dict(BACKGROUND_DEFAULTS, **{k: v for k, v in backgrounds.items() if k in BACKGROUND_DEFAULTS})
+        loras = [[backgrounds["lora"], 1.0]] if backgrounds.get("lora") else []
+        for name, entry in backgrounds["backgrounds"].items():
+            description, seed = parse_entry("background", name, entry)
+            specs.append(dict(
+                settings,
+                prefix="bg_" + name,
+                checkpoint=backgrounds["checkpoint"],
+                loras=loras,
+                positive=description[0],
+                negative=description[1],
+                seed=seed,
+                sampler_name=SAMPLER_NAME,
+                scheduler=SCHEDULER,
+            ))
+
+    for spec in specs:
+        spec["hash"] = asset_hash(spec)
+    # Stable sort: keeps manifest order within a group
+    specs.sort(key=lambda spec: (spec["checkpoint"], json.dumps(spec["loras"])))
+    return specs
+
+
+class AssetStore:
+    """
+    Content-addressed image store: an asset lives at <hash[:2]>/<hash>.png under the root.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        os.makedirs(root, exist_ok=True)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def relative_path(self, digest):
+        return os.path.join(digest[:2], digest + ".png")
+
+    def contains(self, digest):
+        return os.path.exists(os.path.join(self.root, self.relative_path(digest)))
+
+    def put(self, spec, image):
+        """
+        Writes an image tensor (height, width, channels in 0..1) like SaveImage does,
+        with the spec in the PNG metadata.
+        """
+        path = os.path.join(self.root, self.relative_path(spec["hash"]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        i = 255. * image.cpu().numpy()
+        img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+        metadata = PngInfo()
+        metadata.add_text("asset", json.dumps(spec))
+        # A crash mid-write leaves only the temporary file, which the next run overwrites
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        img.save(tmp_path, format="PNG", pnginfo=metadata, compress_level=4)
+        os.replace(tmp_path, path)
+
+    def link(self, spec):
+        self.index[spec["prefix"]] = self.relative_path(spec["hash"]).replace(os.sep, "/")
+
+    def save_index(self):
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+
+class ModelCache:
+    """
+    Keeps the (model, clip, vae) of the last checkpoint and LoRA combination.
+    Specs arrive grouped by combination, so each one is set up once.
+    """
+
+    def __init__(self):
+        self.key = None
+        self.models = None
+
+    def get(self, checkpoint, loras):
+        key = (checkpoint, json.dumps(loras))
+        if key != self.key:
+            checkpointloadersimple_4 = load_checkpoint(checkpoint)
+            model = get_value_at_index(checkpointloadersimple_4, 0)
+            clip = get_value_at_index(checkpointloadersimple_4, 1)
+            for lora_name, strength in loras:
+                model, clip = LoraLoader().load_lora(
+                    model=model, clip=clip, lora_name=lora_name,
+                    strength_model=strength, strength_clip=strength,
+                )
+            self.models = (model, clip, get_value_at_index(checkpointloadersimple_4, 2))
+            self.key = key
+        return self.models
+
+
+def render(spec, models):
+    model, clip, vae = models
+    cliptextencode = CLIPTextEncode()
+    positive = cliptextencode.encode(text=spec["positive"], clip=clip)
+    negative = cliptextencode.encode(text=spec["negative"], clip=clip)
+    latent = EmptyLatentImage().generate(width=spec["width"], height=spec["height"], batch_size=1)
+    samples = KSampler().sample(
+        seed=spec["seed"],
+        steps=spec["steps"],
+        cfg=spec["cfg"],
+        sampler_name=spec["sampler_name"],
+        scheduler=spec["scheduler"],
+        denoise=1,
+        model=model,
+        positive=get_value_at_index(positive, 0),
+        negative=get_value_at_index(negative, 0),
+        latent_image=get_value_at_index(latent, 0),
+    )
+    images = VAEDecode().decode(samples=get_value_at_index(samples, 0), vae=vae)
+    return get_value_at_index(images, 0)[0]
+
+
+def shard_specs(specs, shard):
+    """
+    The specs of shard "I/K": every K-th one starting at I. Taken from the full plan,
+    not from what is left to build, so that shards never disagree about who builds what.
+    """
+    index, count = (int(x) for x in shard.split("/"))
+    return specs[index::count]
+
+
+def build(specs, store, dry_run=False, write_index=True):
+    """
+    Renders every spec that is not in the store yet. Returns (built, skipped).
+    """
+    todo = []
+    for spec in specs:
+        if store.contains(spec["hash"]):
+            store.link(spec)
+        else:
+            todo.append(spec)
+    if write_index:
+        store.save_index()
+    skipped = len(specs) - len(todo)
+    print(f"{len(specs)} assets, {skipped} already built, {len(todo)} to build")
+    if dry_run:
+        for spec in todo:
+            print(f"  would build {spec['prefix']} ({spec['hash'][:12]})")
+        return 0, skipped
+
+    models = ModelCache()
+    t = time.time()
+    with torch.inference_mode():
+        for n, spec in enumerate(todo, 1):
+            image = render(spec, models.get(spec["checkpoint"], spec["loras"]))
+            store.put(spec, image)
+            store.link(spec)
+            if write_index:
+                store.save_index()
+            minutes = (time.time() - t) / 60
+            print(f"[{n}/{len(todo)}] {spec['prefix']} ({spec['hash'][:12]}), {n / minutes:.2f} images/min")
+    return len(todo), skipped
+
+
+def write_shard_report(store, shard, built, skipped, seconds):
+    """
+    Leaves the shard's links and counters for shard_build.py to merge.
+    """
+    import comfy.lora
+    report = {
+        "shard": shard,
+        "built": built,
+        "skipped": skipped,
+        "seconds": seconds,
+        "threads": torch.get_num_threads(),
+        "lora_cache": comfy.lora.get_lora_cache().stats,
+        "links": store.index,
+    }
+    directory = os.path.join(store.root, "shards")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "shard-" + shard.replace("/", "-of-") + ".json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(report, f)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+    if builder_args.threads is not None:
+        torch.set_num_threads(builder_args.threads)
+    specs = plan_assets(load_manifest(builder_args.manifest))
+    store = AssetStore(builder_args.store)
+    if builder_args.shard is not None:
+        # Shards share the store directory, so only the runner writes index.json
+        specs = shard_specs(specs, builder_args.shard)
+        store.index = {}
+    t = time.time()
+    built, skipped = build(specs, store, builder_args.dry_run, write_index=builder_args.shard is None)
+    seconds = time.time() - t
+    minutes = seconds / 60
+    if built:
+        print(f"built {built} images in {minutes:.1f} min ({built / minutes:.2f} images/min), skipped {skipped}")
+    if builder_args.shard is not None and not builder_args.dry_run:
+        write_shard_report(store, builder_args.shard, built, skipped, seconds)
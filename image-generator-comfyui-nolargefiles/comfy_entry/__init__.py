@@ -0,0 +1,132 @@
+"""
+Lightweight programmatic entry point into ComfyUI for the generation scripts.
+
+Importing this package is cheap: it neither touches torch nor ComfyUI. setup() puts
+the ComfyUI root on sys.path and registers extra_model_paths.yaml, without importing
+ComfyUI's main.py, which would also run the custom nodes' prestartup scripts and
+import the web server and prompt executor. The node classes the scripts use are
+imported on first access, e.g. comfy_entry.KSampler; custom nodes are never loaded.
+
+The ComfyUI root is resolved once: from the COMFYUI_ROOT environment variable, else
+from the root cached in comfy_entry/comfyui_root.txt, else by looking for a ComfyUI
+folder next to this package and its parents, which is then written to the cache.
+"""
+import os
+import sys
+
+ROOT_ENV = "COMFYUI_ROOT"
+ROOT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "comfyui_root.txt")
+
+# Node classes used by the scripts, all defined in ComfyUI's nodes.py
+NODE_NAMES = (
+    "CheckpointLoaderSimple",
+    "LoraLoader",
+    "CLIPTextEncode",
+    "EmptyLatentImage",
+    "KSampler",
+    "VAEDecode",
+    "SaveImage",
+)
+
+comfyui_root = None
+
+
+def is_comfyui_root(path):
+    return path is not None and os.path.isfile(os.path.join(path, "nodes.py"))
+
+
+def find_comfyui_root():
+    """
+    Returns the ComfyUI root folder, looking for it on disk only if it isn't configured or cached.
+    """
+    root = os.environ.get(ROOT_ENV)
+    if is_comfyui_root(root):
+        return os.path.abspath(root)
+
+    try:
+        with open(ROOT_CACHE, "r", encoding="utf-8") as f:
+            root = f.read().strip()
+        if is_comfyui_root(root):
+            return root
+    except OSError:
+        pass
+
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    while True:
+        candidate = os.path.join(path, "ComfyUI")
+        if is_comfyui_root(candidate):
+            try:
+                with open(ROOT_CACHE, "w", encoding="utf-8") as f:
+                    f.write(candidate)
+            except OSError:
+                pass
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise FileNotFoundError(f"ComfyUI folder not found, set {ROOT_ENV}")
+        path = parent
+
+
+def load_extra_path_config(yaml_path):
+    """
+    Same as ComfyUI's main.load_extra_path_config, without importing main.
+    """
+    import yaml
+    import folder_paths
+
+    with open(yaml_path, 'r') as stream:
+        config = yaml.safe_load(stream)
+    for c in config:
+        conf = config[c]
+        if conf is None:
+            continue
+        base_path = None
+        if "base_path" in conf:
+            base_path = conf.pop("base_path")
+        for x in conf:
+            for y in conf[x].split("\n"):
+                if len(y) == 0:
+                    continue
+                full_path = y
+                if base_path is not None:
+                    full_path = os.path.join(base_path, full_path)
+                print("Adding extra search path", x, full_path)
+                folder_paths.add_model_folder_path(x, full_path)
+
+
+def setup():
+    """
+    Makes ComfyUI importable and registers the extra model paths. Safe to call more than once.
+    Like importing main.py did, ComfyUI's command line arguments are parsed from sys.argv.
+    """
+    global comfyui_root
+    if comfyui_root is not None:
+        return comfyui_root
+    root = find_comfyui_root()
+    if root not in sys.path:
+        sys.path.append(root)
+
+    import comfy.options
+    comfy.options.enable_args_parsing()
+
+    if os.name == "nt":
+        import logging
+        logging.getLogger("xformers").addFilter(lambda record: 'A matching Triton is not available' not in record.getMessage())
+
+    for folder in (root, os.path.dirname(root)):
+        extra_model_paths = os.path.join(folder, "extra_model_paths.yaml")
+        if os.path.isfile(extra_model_paths):
+            load_extra_path_config(extra_model_paths)
+            break
+    comfyui_root = root
+    return root
+
+
+def __getattr__(name):
+    if name in NODE_NAMES:
+        setup()
+        import nodes
+        value = getattr(nodes, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -29,92 +29,178 @@ def get_value_at_index(obj: Union[Sequence, Mapping], index: int) -> Any:
         return obj["result"][index]
 
 
-def find_path(name: str, path: str = None) -> str:
+# --batch-size N renders up to N backgrounds per sampler call; has to go before ComfyUI parses the command line on import
+BATCH_SIZE = 1
+if "--batch-size" in sys.argv:
+    BATCH_SIZE = int(sys.argv[sys.argv.index("--batch-size") + 1])
+    del sys.argv[sys.argv.index("--batch-size"):sys.argv.index("--batch-size") + 2]
+# --direct samples every background at full size; --compare-two-stage times both paths
+DIRECT = "--direct" in sys.argv
+if DIRECT:
+    sys.argv.remove("--direct")
+COMPARE_TWO_STAGE = "--compare-two-stage" in sys.argv
+if COMPARE_TWO_STAGE:
+    sys.argv.remove("--compare-two-stage")
+
+# Resolves the ComfyUI root and imports only the node classes used below, without main.py
+from comfy_entry import (
+    CLIPTextEncode,
+    VAEDecode,
+    EmptyLatentImage,
+    SaveImage,
+    KSampler,
+    CheckpointLoaderSimple,
+    LoraLoader,
+)
+import folder_paths
+import comfy.sample
+import comfy.utils
+
+WIDTH, HEIGHT = 1920, 1200
+STEPS = 20
+
+# Two-stage ("hires fix") rendering: a full denoise at draft_scale of the final size,
+# a latent upscale to full size, then a short partial denoise that adds the detail back.
+# Attention cost grows with the square of the latent size, so at 1920x1200 on CPU this is
+# several times faster than sampling all steps at full size. A background can override
+# any of these with a third entry, e.g. {"hires_denoise": 0.6}, or {"two_stage": False}
+# to be sampled directly at full size.
+TWO_STAGE_DEFAULTS = {
+    "two_stage": True,
+    "draft_scale": 0.6,  # 1152x720, close to the ~1 megapixel SDXL was trained at
+    "draft_steps": 20,
+    "upscale_method": "bislerp",
+    "hires_steps": 8,
+    "hires_denoise": 0.5,
+}
+
+# Loaded checkpoint and LoRA outputs keyed by (ckpt_name, lora_name). A long-lived process
+# such as generation_worker.py keeps the weights in memory between calls to main().
+loaded_models = {}
+
+
+def load_models(ckpt_name: str, lora_name: str):
     """
-    Recursively looks at parent folders starting from the given path until it finds the given name.
-    Returns the path as a Path object if found, or None otherwise.
+    Returns the CheckpointLoaderSimple and LoraLoader outputs for the pair, loading them only on first use.
     """
-    # If no path is given, use the current working directory
-    if path is None:
-        path = os.getcwd()
-
-    # Check if the current directory contains the name
-    if name in os.listdir(path):
-        path_name = os.path.join(path, name)
-        print(f"{name} found: {path_name}")
-        return path_name
-
-    # Get the parent directory
-    parent_directory = os.path.dirname(path)
+    if (ckpt_name, lora_name) not in loaded_models:
+        checkpointloadersimple_4 = CheckpointLoaderSimple().load_checkpoint(
+            ckpt_name=ckpt_name
+        )
+        loraloader_10 = LoraLoader().load_lora(
+            lora_name=lora_name,
+            strength_model=1,
+            strength_clip=1,
+            model=get_value_at_index(checkpointloadersimple_4, 0),
+            clip=get_value_at_index(checkpointloadersimple_4, 1),
+        )
+        loaded_models[(ckpt_name, lora_name)] = (checkpointloadersimple_4, loraloader_10)
+    return loaded_models[(ckpt_name, lora_name)]
 
-    # If the parent directory is the same as the current directory, we've reached the root and stop the search
-    if parent_directory == path:
-        return None
 
-    # Recursively call the function with the parent directory
-    return find_path(name, parent_directory)
+def get_saved_paths(saveimage_result) -> list:
+    """
+    Converts the ui result of SaveImage.save_images into absolute file paths.
+    """
+    output_dir = folder_paths.get_output_directory()
+    return [
+        os.path.join(output_dir, image["subfolder"], image["filename"])
+        for image in saveimage_result["ui"]["images"]
+    ]
 
 
-def add_comfyui_directory_to_sys_path() -> None:
+def background_settings(description, two_stage=True):
     """
-    Add 'ComfyUI' to the sys.path
+    Returns the rendering settings of a background: TWO_STAGE_DEFAULTS with the overrides
+    from the optional third entry of its description.
     """
-    comfyui_path = find_path("ComfyUI")
-    if comfyui_path is not None and os.path.isdir(comfyui_path):
-        sys.path.append(comfyui_path)
-        print(f"'{comfyui_path}' added to sys.path")
+    settings = dict(TWO_STAGE_DEFAULTS)
+    if len(description) > 2 and description[2]:
+        settings.update(description[2])
+    if not two_stage:
+        settings["two_stage"] = False
+    return settings
 
 
-def add_extra_model_paths() -> None:
+def plan_batches(items, seeds, batch_size, two_stage=True):
     """
-    Parse the optional extra_model_paths.yaml file and add the parsed paths to the sys.path.
+    Splits (name, description) items into batches of up to batch_size consecutive
+    backgrounds that share their settings. Yields (batch, seeds, settings).
     """
-    from main import load_extra_path_config
-
-    extra_model_paths = find_path("extra_model_paths.yaml")
+    batch, batch_seeds, batch_settings = [], [], None
+    for item, seed in zip(items, seeds):
+        settings = background_settings(item[1], two_stage)
+        if batch and (settings != batch_settings or len(batch) == batch_size):
+            yield batch, batch_seeds, batch_settings
+            batch, batch_seeds = [], []
+        batch.append(item)
+        batch_seeds.append(seed)
+        batch_settings = settings
+    if batch:
+        yield batch, batch_seeds, batch_settings
+
+
+def sample_background(ksampler, emptylatentimage, model, positive, negative, seeds, settings):
+    """
+    Samples a latent batch of full-size backgrounds, one per seed, directly or in two stages.
+    """
+    def sample(latent, steps, denoise):
+        # With denoise < 1 the sampler runs only the last steps of a longer schedule
+        ksampler_3 = ksampler.sample(
+            seed=seeds[0],
+            steps=steps,
+            cfg=8,
+            sampler_name="euler",
+            scheduler="normal",
+            denoise=denoise,
+            model=model,
+            positive=positive,
+            negative=negative,
+            latent_image=latent,
+        )
+        return get_value_at_index(ksampler_3, 0)
 
-    if extra_model_paths is not None:
-        load_extra_path_config(extra_model_paths)
+    if settings["two_stage"]:
+        width = max(64, round(WIDTH * settings["draft_scale"] / 8) * 8)
+        height = max(64, round(HEIGHT * settings["draft_scale"] / 8) * 8)
     else:
-        print("Could not find the extra_model_paths config file.")
+        width, height = WIDTH, HEIGHT
+    emptylatentimage_5 = emptylatentimage.generate(
+        width=width, height=height, batch_size=len(seeds)
+    )
+    latent = get_value_at_index(emptylatentimage_5, 0)
+    if len(seeds) > 1:
+        latent = dict(latent, batch_seeds=seeds)
 
+    if not settings["two_stage"]:
+        return sample(latent, STEPS, 1)
 
-add_comfyui_directory_to_sys_path()
-add_extra_model_paths()
+    draft = sample(latent, settings["draft_steps"], 1)
+    upscaled = comfy.utils.common_upscale(
+        draft["samples"], WIDTH // 8, HEIGHT // 8, settings["upscale_method"], "disabled"
+    )
+    return sample(dict(draft, samples=upscaled), settings["hires_steps"], settings["hires_denoise"])
 
-from nodes import (
-    CLIPTextEncode,
-    VAEDecode,
-    EmptyLatentImage,
-    SaveImage,
-    NODE_CLASS_MAPPINGS,
-    KSampler,
-    CheckpointLoaderSimple,
-    LoraLoader,
-)
 
+def main(backgrounds=None, batch_size=1, two_stage=True):
+    """
+    Generates one image per background and returns the saved file paths.
 
-def main(backgrounds):
+    With batch_size > 1, up to batch_size backgrounds share each sampler call. Every
+    background keeps its own prompt and seed, and the latent batch is seeded per item,
+    so each one starts from the same noise as when rendered alone. Backgrounds are
+    rendered in two stages (see TWO_STAGE_DEFAULTS) unless two_stage is False.
+    """
+    if backgrounds is None:
+        backgrounds = DEFAULT_BACKGROUNDS
+    saved_paths = []
     with torch.inference_mode():
-        checkpointloadersimple = CheckpointLoaderSimple()
-        checkpointloadersimple_4 = checkpointloadersimple.load_checkpoint(
-            ckpt_name="cartoonArcadiaSDXLSD1_xenoArcadiaCX.safetensors"
+        checkpointloadersimple_4, loraloader_10 = load_models(
+            "cartoonArcadiaSDXLSD1_xenoArcadiaCX.safetensors",
+            "EldritchComicsXL1.2.safetensors",
         )
 
         emptylatentimage = EmptyLatentImage()
-        emptylatentimage_5 = emptylatentimage.generate(
-            width=1920, height=1200, batch_size=1
-        )
-
-        loraloader = LoraLoader()
-        loraloader_10 = loraloader.load_lora(
-            lora_name="EldritchComicsXL1.2.safetensors",
-            strength_model=1,
-            strength_clip=1,
-            model=get_value_at_index(checkpointloadersimple_4, 0),
-            clip=get_value_at_index(checkpointloadersimple_4, 1),
-        )
-
         cliptextencode = CLIPTextEncode()
         
 
@@ -122,52 +208,83 @@ def main(backgrounds):
         vaedecode = VAEDecode()
         saveimage = SaveImage()
 
-        for name, description in backgrounds.items():
-            cliptextencode_6 = cliptextencode.encode(
-                text=description[0],
-                clip=get_value_at_index(loraloader_10, 1),
-            )
-
-            cliptextencode_7 = cliptextencode.encode(
-                text=description[1], 
-                clip=get_value_at_index(loraloader_10, 1)
-            )
-                
-            ksampler_3 = ksampler.sample(
-                seed=random.randint(1, 2**64),
-                steps=20,
-                cfg=8,
-                sampler_name="euler",
-                scheduler="normal",
-                denoise=1,
-                model=get_value_at_index(loraloader_10, 0),
-                positive=get_value_at_index(cliptextencode_6, 0),
-                negative=get_value_at_index(cliptextencode_7, 0),
-                latent_image=get_value_at_index(emptylatentimage_5, 0),
-            )
-
-            vaedecode_8 = vaedecode.decode(
-                samples=get_value_at_index(ksampler_3, 0),
-                vae=get_value_at_index(checkpointloadersimple_4, 2),
-            )
-
-            saveimage_9 = saveimage.save_images(
-                filename_prefix="bg_"+name, images=get_value_at_index(vaedecode_8, 0)
-            )
+        items = list(backgrounds.items())
+        seeds = [random.randint(1, 2**64) for _ in items]
+
+        for batch, batch_seeds, settings in plan_batches(items, seeds, batch_size, two_stage):
+            positives = [
+                get_value_at_index(cliptextencode.encode(text=description[0], clip=get_value_at_index(loraloader_10, 1)), 0)
+                for name, description in batch
+            ]
+            negatives = [
+                get_value_at_index(cliptextencode.encode(text=description[1], clip=get_value_at_index(loraloader_10, 1)), 0)
+                for name, description in batch
+            ]
+            positive = comfy.sample.batch_conditioning(positives)
+            negative = comfy.sample.batch_conditioning(negatives)
+            if len(batch) == 1 or positive is None or negative is None:
+                # Prompts of different token lengths can't share a batch
+                groups = [([item], [seed], [pos], [neg]) for item, seed, pos, neg in zip(batch, batch_seeds, positives, negatives)]
+            else:
+                groups = [(batch, batch_seeds, [positive], [negative])]
+
+            for group, group_seeds, (positive,), (negative,) in groups:
+                samples = sample_background(
+                    ksampler, emptylatentimage, get_value_at_index(loraloader_10, 0),
+                    positive, negative, group_seeds, settings,
+                )
+
+                vaedecode_8 = vaedecode.decode(
+                    samples=samples,
+                    vae=get_value_at_index(checkpointloadersimple_4, 2),
+                )
+
+                images = get_value_at_index(vaedecode_8, 0)
+                for i, (name, description) in enumerate(group):
+                    saveimage_9 = saveimage.save_images(
+                        filename_prefix="bg_"+name, images=images[i:i+1]
+                    )
+                    saved_paths += get_saved_paths(saveimage_9)
+
+    return saved_paths
+
+
+DEFAULT_BACKGROUNDS = {
+    #format
+    #name: [positive prompt, negative prompt] or [positive prompt, negative prompt, {two-stage overrides}]
+    'glade': ['clearing in a forest, peaceful and serene woods', ''],
+    'mountain': ['tall snow-capped mountains, with trees and rocks', ''],
+    'desert': ['a desert landscape with rocks and sand', ''],
+    'city': ['cityscape with medieval european buildings and architecture', ''],
+    'shop': ['inside a cozy potion shop, shelves stacked with goods and wares', 'person, shopkeeper'],
+}
+
+
+def compare_two_stage(backgrounds, batch_size=1):
+    """
+    Renders the backgrounds directly and in two stages and prints the wall time of each.
+    """
+    import time
+    # Load the weights first so that neither path pays for it
+    load_models(
+        "cartoonArcadiaSDXLSD1_xenoArcadiaCX.safetensors",
+        "EldritchComicsXL1.2.safetensors",
+    )
+    times = {}
+    for label, two_stage in (("direct", False), ("two-stage", True)):
+        t = time.time()
+        main(backgrounds, batch_size=batch_size, two_stage=two_stage)
+        times[label] = time.time() - t
+        print(f"{label}: {times[label]:.1f}s for {len(backgrounds)} backgrounds")
+    print(f"two-stage speedup: {times['direct'] / times['two-stage']:.2f}x")
 
 
 if __name__ == "__main__":
     import time
     t = time.time()
-    backgrounds = {
-        #format
-        #name: [positive prompt, negative prompt]
-        'glade': ['clearing in a forest, peaceful and serene woods', ''],
-        'mountain': ['tall snow-capped mountains, with trees and rocks', ''],
-        'desert': ['a desert landscape with rocks and sand', ''],
-        'city': ['cityscape with medieval european buildings and architecture', ''],
-        'shop': ['inside a cozy potion shop, shelves stacked with goods and wares', 'person, shopkeeper'],
-    }
-    main(backgrounds)
+    if COMPARE_TWO_STAGE:
+        compare_two_stage(DEFAULT_BACKGROUNDS, batch_size=BATCH_SIZE)
+    else:
+        main(DEFAULT_BACKGROUNDS, batch_size=BATCH_SIZE, two_stage=not DIRECT)
     
     print("finished in", time.time() - t)
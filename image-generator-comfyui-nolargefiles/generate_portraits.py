@@ -29,87 +29,87 @@ def get_value_at_index(obj: Union[Sequence, Mapping], index: int) -> Any:
         return obj["result"][index]
 
 
-def find_path(name: str, path: str = None) -> str:
-    """
-    Recursively looks at parent folders starting from the given path until it finds the given name.
-    Returns the path as a Path object if found, or None otherwise.
-    """
-    # If no path is given, use the current working directory
-    if path is None:
-        path = os.getcwd()
-
-    # Check if the current directory contains the name
-    if name in os.listdir(path):
-        path_name = os.path.join(path, name)
-        print(f"{name} found: {path_name}")
-        return path_name
-
-    # Get the parent directory
-    parent_directory = os.path.dirname(path)
-
-    # If the parent directory is the same as the current directory, we've reached the root and stop the search
-    if parent_directory == path:
-        return None
+# Our own flag has to go before ComfyUI parses the command line on import
+COMPARE_ORDER = "--compare-order" in sys.argv
+if COMPARE_ORDER:
+    sys.argv.remove("--compare-order")
+# --batch-size N renders up to N characters per sampler call
+BATCH_SIZE = 1
+if "--batch-size" in sys.argv:
+    BATCH_SIZE = int(sys.argv[sys.argv.index("--batch-size") + 1])
+    del sys.argv[sys.argv.index("--batch-size"):sys.argv.index("--batch-size") + 2]
+
+# Resolves the ComfyUI root and imports only the node classes used below, without main.py
+from comfy_entry import (
+    CheckpointLoaderSimple,
+    KSampler,
+    LoraLoader,
+    VAEDecode,
+    CLIPTextEncode,
+    SaveImage,
+    EmptyLatentImage,
+)
+import folder_paths
+import comfy.sample
 
-    # Recursively call the function with the parent directory
-    return find_path(name, parent_directory)
+# Loaded (model, clip, vae) tuples by checkpoint name. A long-lived process such as
+# generation_worker.py keeps the weights in memory between calls to main().
+loaded_checkpoints = {}
 
 
-def add_comfyui_directory_to_sys_path() -> None:
+def load_checkpoint(ckpt_name: str):
     """
-    Add 'ComfyUI' to the sys.path
+    Returns the CheckpointLoaderSimple output for ckpt_name, loading it only on first use.
     """
-    comfyui_path = find_path("ComfyUI")
-    if comfyui_path is not None and os.path.isdir(comfyui_path):
-        sys.path.append(comfyui_path)
-        print(f"'{comfyui_path}' added to sys.path")
+    if ckpt_name not in loaded_checkpoints:
+        loaded_checkpoints[ckpt_name] = CheckpointLoaderSimple().load_checkpoint(
+            ckpt_name=ckpt_name
+        )
+    return loaded_checkpoints[ckpt_name]
 
 
-def add_extra_model_paths() -> None:
+def get_saved_paths(saveimage_result) -> list:
     """
-    Parse the optional extra_model_paths.yaml file and add the parsed paths to the sys.path.
+    Converts the ui result of SaveImage.save_images into absolute file paths.
     """
-    from main import load_extra_path_config
+    output_dir = folder_paths.get_output_directory()
+    return [
+        os.path.join(output_dir, image["subfolder"], image["filename"])
+        for image in saveimage_result["ui"]["images"]
+    ]
 
-    extra_model_paths = find_path("extra_model_paths.yaml")
 
-    if extra_model_paths is not None:
-        load_extra_path_config(extra_model_paths)
-    else:
-        print("Could not find the extra_model_paths config file.")
+# Expression portraits drawn on top of the neutral face: (LoRA file, prompt prefix, expression name)
+EXPRESSION_LORAS = [
+    ("sensualface_type4.safetensors", "happy, smiling, ", "happy"),
+    ("doyagao_v080.safetensors", "smug expression, ", "smug"),
+    ("gekioko_v250.safetensors", "angry, frown,", "angry"),
+    ("worriedeyes_v100.safetensors", "worried, scared, ", "worried"),
+    ("yudedako_v100.safetensors", "embarassed, ashamed, ", "embarassed"),
+    ("hotarueye_heart1_v100.safetensors", "heart eye, happy ", "heart-eyed"),
+    ("hotarueye_star1_v100.safetensors", "star eye, joyous, ", "starry-eyed"),
+]
 
+# The neutral face uses the plain checkpoint
+NEUTRAL_EXPRESSION = (None, "", "neutral")
 
-add_comfyui_directory_to_sys_path()
-add_extra_model_paths()
 
-from nodes import (
-    CheckpointLoaderSimple,
-    KSampler,
-    LoraLoader,
-    VAEDecode,
-    CLIPTextEncode,
-    SaveImage,
-    NODE_CLASS_MAPPINGS,
-    EmptyLatentImage,
-)
-
-def gen_neutral_face(name, description, checkpointloadersimple_4, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed):
+def gen_face(name, description, lora_prompt, expression_name, model, clip, vae, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed):
 
     emptylatentimage_5 = emptylatentimage.generate(
         width=512, height=512, batch_size=1
     )
 
     cliptextencode_6 = cliptextencode.encode(
-        text="face front, " + description[0],
-        clip=get_value_at_index(checkpointloadersimple_4, 1),
+        text="face front, " + lora_prompt + description[0],
+        clip=clip,
     )
 
     cliptextencode_7 = cliptextencode.encode(
         text="background, text, hand" + description[1],
-        clip=get_value_at_index(checkpointloadersimple_4, 1),
+        clip=clip,
     )
 
-    
     ksampler_3 = ksampler.sample(
         seed=seed,
         steps=20,
@@ -117,7 +117,7 @@ def gen_neutral_face(name, description, checkpointloadersimple_4, emptylatentima
         sampler_name="euler",
         scheduler="normal",
         denoise=1,
-        model=get_value_at_index(checkpointloadersimple_4, 0),
+        model=model,
         positive=get_value_at_index(cliptextencode_6, 0),
         negative=get_value_at_index(cliptextencode_7, 0),
         latent_image=get_value_at_index(emptylatentimage_5, 0),
@@ -125,66 +125,118 @@ def gen_neutral_face(name, description, checkpointloadersimple_4, emptylatentima
 
     vaedecode_8 = vaedecode.decode(
         samples=get_value_at_index(ksampler_3, 0),
-        vae=get_value_at_index(checkpointloadersimple_4, 2),
+        vae=vae,
     )
 
     saveimage_9 = saveimage.save_images(
-        filename_prefix=name+"_neutral", images=get_value_at_index(vaedecode_8, 0)
-    )
-
-def gen_lora_face(name, description, lora_name, lora_prompt, expression_name, checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed):
-
-    emptylatentimage_5 = emptylatentimage.generate(
-        width=512, height=512, batch_size=1
+        filename_prefix=name+"_"+expression_name, images=get_value_at_index(vaedecode_8, 0)
     )
+    return get_saved_paths(saveimage_9)
 
-    loraloader_10 = loraloader.load_lora(
-        lora_name=lora_name,
-        strength_model=1,
-        strength_clip=1,
-        model=get_value_at_index(checkpointloadersimple_4, 0),
-        clip=get_value_at_index(checkpointloadersimple_4, 1),
-    )
+def gen_faces_batched(jobs, lora_prompt, expression_name, model, clip, vae, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage):
+    """
+    Renders one expression for several characters, given as (name, description, seed), in one sampler call.
 
-    cliptextencode_6 = cliptextencode.encode(
-        text="face front, " + lora_prompt + description[0],
-        clip=get_value_at_index(loraloader_10, 1),
-    )
+    Every character keeps its own prompt and seed; the latent batch is seeded per item,
+    so each face starts from the noise gen_face would use for it and is saved under the same name.
+    """
+    if len(jobs) == 1:
+        name, description, seed = jobs[0]
+        return gen_face(name, description, lora_prompt, expression_name, model, clip, vae, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed)
+
+    positive = comfy.sample.batch_conditioning([
+        get_value_at_index(cliptextencode.encode(text="face front, " + lora_prompt + description[0], clip=clip), 0)
+        for name, description, seed in jobs
+    ])
+    negative = comfy.sample.batch_conditioning([
+        get_value_at_index(cliptextencode.encode(text="background, text, hand" + description[1], clip=clip), 0)
+        for name, description, seed in jobs
+    ])
+    if positive is None or negative is None:
+        # Prompts of different token lengths can't share a batch
+        saved_paths = []
+        for name, description, seed in jobs:
+            saved_paths += gen_face(name, description, lora_prompt, expression_name, model, clip, vae, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed)
+        return saved_paths
 
-    cliptextencode_7 = cliptextencode.encode(
-        text="background, text, hand" + description[1],
-        clip=get_value_at_index(loraloader_10, 1),
+    emptylatentimage_5 = emptylatentimage.generate(
+        width=512, height=512, batch_size=len(jobs)
     )
-
+    latent = dict(get_value_at_index(emptylatentimage_5, 0), batch_seeds=[seed for name, description, seed in jobs])
 
     ksampler_3 = ksampler.sample(
-        seed=seed,
+        seed=jobs[0][2],
         steps=20,
         cfg=8,
         sampler_name="euler",
         scheduler="normal",
         denoise=1,
-        model=get_value_at_index(loraloader_10, 0),
-        positive=get_value_at_index(cliptextencode_6, 0),
-        negative=get_value_at_index(cliptextencode_7, 0),
-        latent_image=get_value_at_index(emptylatentimage_5, 0),
+        model=model,
+        positive=positive,
+        negative=negative,
+        latent_image=latent,
     )
 
     vaedecode_8 = vaedecode.decode(
         samples=get_value_at_index(ksampler_3, 0),
-        vae=get_value_at_index(checkpointloadersimple_4, 2),
+        vae=vae,
     )
 
-    saveimage_9 = saveimage.save_images(
-        filename_prefix=name+"_"+expression_name, images=get_value_at_index(vaedecode_8, 0)
+    images = get_value_at_index(vaedecode_8, 0)
+    saved_paths = []
+    for i, (name, description, seed) in enumerate(jobs):
+        saveimage_9 = saveimage.save_images(
+            filename_prefix=name+"_"+expression_name, images=images[i:i+1]
+        )
+        saved_paths += get_saved_paths(saveimage_9)
+    return saved_paths
+
+def gen_neutral_face(name, description, checkpointloadersimple_4, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed):
+    return gen_face(name, description, "", "neutral", get_value_at_index(checkpointloadersimple_4, 0), get_value_at_index(checkpointloadersimple_4, 1), get_value_at_index(checkpointloadersimple_4, 2), emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed)
+
+def gen_lora_face(name, description, lora_name, lora_prompt, expression_name, checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed):
+    loraloader_10 = load_expression_lora(lora_name, checkpointloadersimple_4, loraloader)
+    return gen_face(name, description, lora_prompt, expression_name, get_value_at_index(loraloader_10, 0), get_value_at_index(loraloader_10, 1), get_value_at_index(checkpointloadersimple_4, 2), emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed)
+
+def load_expression_lora(lora_name, checkpointloadersimple_4, loraloader):
+    """
+    Returns the (model, clip) pair for an expression, or the plain checkpoint's for lora_name None.
+    """
+    if lora_name is None:
+        return checkpointloadersimple_4[:2]
+    return loraloader.load_lora(
+        lora_name=lora_name,
+        strength_model=1,
+        strength_clip=1,
+        model=get_value_at_index(checkpointloadersimple_4, 0),
+        clip=get_value_at_index(checkpointloadersimple_4, 1),
     )
 
-def main(characters):
+def plan_portrait_jobs(characters, lora_major=True):
+    """
+    Orders the (character x expression) matrix for rendering as a list of (expression, character name).
+
+    Every LoRA load gives a new patched model, and ComfyUI re-merges the LoRA into the
+    UNet weights whenever it samples with a different model than the last one. Going
+    LoRA-major patches each LoRA once and renders every character under it; going
+    character-major (the old order) patches once per character and expression.
+    """
+    expressions = [NEUTRAL_EXPRESSION] + EXPRESSION_LORAS
+    if lora_major:
+        return [(expression, name) for expression in expressions for name in characters]
+    return [(expression, name) for name in characters for expression in expressions]
+
+def main(characters=None, lora_major=True, batch_size=1):
+    """
+    Generates the neutral and expression portraits for every character and returns the saved file paths.
+    File names do not depend on lora_major, only the order in which they are rendered.
+    With batch_size > 1 and lora_major, up to batch_size characters share each sampler call.
+    """
+    if characters is None:
+        characters = DEFAULT_CHARACTERS
+    saved_paths = []
     with torch.inference_mode():
-        checkpointloadersimple = CheckpointLoaderSimple()
-        checkpointloadersimple_4 = checkpointloadersimple.load_checkpoint(
-            ckpt_name="irismix_v90.safetensors"
-        )
+        checkpointloadersimple_4 = load_checkpoint("irismix_v90.safetensors")
 
         emptylatentimage = EmptyLatentImage()
 
@@ -195,39 +247,75 @@ def main(characters):
         vaedecode = VAEDecode()
         saveimage = SaveImage()
 
-        
-
-
-        for name, description in characters.items():
-            seed = random.randint(1, 2**64)    
-            #generate neutral face
-            gen_neutral_face(name, description, checkpointloadersimple_4, emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # happy
-            gen_lora_face(name, description, "sensualface_type4.safetensors", "happy, smiling, ", "happy", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # smug
-            gen_lora_face(name, description, "doyagao_v080.safetensors", "smug expression, ", "smug", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # angry
-            gen_lora_face(name, description, "gekioko_v250.safetensors", "angry, frown,", "angry", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # worried
-            gen_lora_face(name, description, "worriedeyes_v100.safetensors", "worried, scared, ", "worried", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # embarassed
-            gen_lora_face(name, description, "yudedako_v100.safetensors", "embarassed, ashamed, ", "embarassed", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # heart-eye
-            gen_lora_face(name, description, "hotarueye_heart1_v100.safetensors", "heart eye, happy ", "heart-eyed", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-            # star-eye
-            gen_lora_face(name, description, "hotarueye_star1_v100.safetensors", "star eye, joyous, ", "starry-eyed", checkpointloadersimple_4, emptylatentimage, loraloader, cliptextencode, ksampler, vaedecode, saveimage, seed)
-        
+        # Every expression of a character shares its seed
+        seeds = {name: random.randint(1, 2**64) for name in characters}
 
+        # Consecutive jobs with the same expression are batched together
+        batches = []
+        for expression, name in plan_portrait_jobs(characters, lora_major):
+            if batches and batches[-1][0] == expression and len(batches[-1][1]) < batch_size:
+                batches[-1][1].append(name)
+            else:
+                batches.append((expression, [name]))
 
-if __name__ == "__main__":
+        current_lora = None
+        loraloader_10 = None
+        for (lora_name, lora_prompt, expression_name), names in batches:
+            if loraloader_10 is None or lora_name != current_lora:
+                loraloader_10 = load_expression_lora(lora_name, checkpointloadersimple_4, loraloader)
+                current_lora = lora_name
+            jobs = [(name, characters[name], seeds[name]) for name in names]
+            saved_paths += gen_faces_batched(jobs, lora_prompt, expression_name, get_value_at_index(loraloader_10, 0), get_value_at_index(loraloader_10, 1), get_value_at_index(checkpointloadersimple_4, 2), emptylatentimage, cliptextencode, ksampler, vaedecode, saveimage)
+
+    return saved_paths
+
+
+def run_counting_patches(characters, lora_major, batch_size=1):
+    """
+    Runs main() and returns (number of ModelPatcher.patch_model calls, wall time in seconds).
+    """
     import time
+    import comfy.model_patcher
+
+    patch_model = comfy.model_patcher.ModelPatcher.patch_model
+    patches = [0]
+
+    def counting_patch_model(self, *args, **kwargs):
+        patches[0] += 1
+        return patch_model(self, *args, **kwargs)
+
+    comfy.model_patcher.ModelPatcher.patch_model = counting_patch_model
     t = time.time()
-    characters = {
-        #format:
-        #name: [positive prompt/description of character, negative prompt]
-        'Sorceress': ['Young sorceress, short brown hair, girl, brown eyes, purple robe', 'boy'],
-        'Explorer': ['Young explorer man, short wavy blond hair, blue eyes, white shirt', 'girl']
-    }
-    main(characters)
-    
-    print("finished in", time.time() - t)
+    try:
+        main(characters, lora_major, batch_size)
+    finally:
+        comfy.model_patcher.ModelPatcher.patch_model = patch_model
+    return patches[0], time.time() - t
+
+
+DEFAULT_CHARACTERS = {
+    #format:
+    #name: [positive prompt/description of character, negative prompt]
+    'Sorceress': ['Young sorceress, short brown hair, girl, brown eyes, purple robe', 'boy'],
+    'Explorer': ['Young explorer man, short wavy blond hair, blue eyes, white shirt', 'girl']
+}
+
+
+if __name__ == "__main__":
+    if COMPARE_ORDER:
+        # Load the checkpoint first so that neither run pays for it
+        load_checkpoint("irismix_v90.safetensors")
+        for lora_major in (False, True):
+            patches, seconds = run_counting_patches(DEFAULT_CHARACTERS, lora_major, BATCH_SIZE if lora_major else 1)
+            order = "LoRA-major" if lora_major else "character-major"
+            print(f"{order}: {patches} model patches, finished in {seconds:.1f}s")
+        import comfy.lora
+        import comfy.sd
+        print("LoRA cache:", comfy.lora.get_lora_cache().stats)
+        print("CLIP conditioning cache:", comfy.sd.conditioning_cache.stats)
+    else:
+        import time
+        t = time.time()
+        main(DEFAULT_CHARACTERS, batch_size=BATCH_SIZE)
+
+        print("finished in", time.time() - t)
@@ -0,0 +1,230 @@
+"""
+Long-lived image generation service for the game client.
+
+The worker imports ComfyUI once, keeps the loaded checkpoints in memory and runs
+portrait/background jobs submitted over a local multiprocessing connection, so only
+the first job pays for the torch import and the checkpoint load.
+
+Run command (any extra arguments are passed on to ComfyUI):
+    .\\python_embeded\\python.exe -s generation_worker.py --worker-port 8765 --cpu
+
+Jobs run one at a time, lowest priority value first. Jobs that have not started yet can
+be cancelled or reprioritized, which lets the game prefetch art speculatively. Cancelling
+the running job interrupts it at the next sampling step.
+
+Protocol, as pickled tuples:
+    client -> worker: ("submit", job_id, kind, payload, priority) | ("cancel", job_id)
+                      | ("reprioritize", job_id, priority) | ("shutdown",)
+    worker -> client: ("done", job_id, saved_paths) | ("error", job_id, message)
+                      | ("cancelled", job_id, None)
+"""
+import argparse
+import heapq
+import itertools
+import os
+import sys
+import threading
+import traceback
+from multiprocessing.connection import Listener
+
+worker_parser = argparse.ArgumentParser()
+worker_parser.add_argument("--worker-host", type=str, default="127.0.0.1", help="Address to listen on for jobs.")
+worker_parser.add_argument("--worker-port", type=int, default=8765, help="Port to listen on for jobs.")
+worker_args, comfy_argv = worker_parser.parse_known_args()
+# Everything we don't understand is for ComfyUI's own argument parser, which runs on import
+sys.argv = sys.argv[:1] + comfy_argv
+
+import generate_portraits
+import generate_background
+import comfy.model_management
+import comfy.utils
+
+AUTHKEY = os.environ.get("DND_GENERATION_AUTHKEY", "dnd-generation").encode()
+
+JOB_HANDLERS = {
+    "portraits": generate_portraits.main,
+    "backgrounds": generate_background.main,
+}
+
+
+class JobQueue:
+    """
+    Pending jobs ordered by priority (lower runs first), then by submission order.
+    Jobs that have not started yet can be cancelled or given a new priority.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.closed = None
+
+    def put(self, job_id, kind, payload, priority):
+        with self.condition:
+            entry = [priority, next(self.counter), job_id, kind, payload]
+            self.entries[job_id] = entry
+            heapq.heappush(self.heap, entry)
+            self.condition.notify()
+
+    def get(self):
+        """
+        Blocks until a job is available and returns (job_id, kind, payload).
+        Returns None on disconnect and "shutdown" when the client asked the worker to exit.
+        """
+        with self.condition:
+            while True:
+                while self.heap:
+                    entry = heapq.heappop(self.heap)
+                    if entry[2] is None:
+                        continue  # cancelled or reprioritized
+                    del self.entries[entry[2]]
+                    return tuple(entry[2:])
+                if self.closed is not None:
+                    return self.closed
+                self.condition.wait()
+
+    def remove(self, job_id):
+        """
+        Removes a job that has not started yet. Returns the removed entry, or None.
+        """
+        entry = self.entries.pop(job_id, None)
+        if entry is not None:
+            removed = list(entry)
+            entry[2] = None  # lazily dropped by get()
+            return removed
+        return None
+
+    def cancel(self, job_id):
+        with self.condition:
+            return self.remove(job_id) is not None
+
+    def reprioritize(self, job_id, priority):
+        with self.condition:
+            entry = self.remove(job_id)
+            if entry is not None:
+                entry[0] = priority
+                self.entries[job_id] = entry
+                heapq.heappush(self.heap, entry)
+
+    def close(self, reason):
+        with self.condition:
+            self.closed = reason
+            self.condition.notify()
+
+
+class RunningJob:
+    """
+    Tracks the job being executed so that a cancel message can interrupt it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job_id = None
+        # Cancelled jobs that had already left the queue but not started yet
+        self.cancelled = set()
+
+    def start(self, job_id):
+        with self.lock:
+            self.job_id = job_id
+            interrupted = job_id in self.cancelled
+            self.cancelled.discard(job_id)
+            comfy.model_management.interrupt_current_processing(interrupted)
+
+    def finish(self):
+        with self.lock:
+            self.job_id = None
+
+    def interrupt(self, job_id):
+        with self.lock:
+            if job_id == self.job_id:
+                comfy.model_management.interrupt_current_processing(True)
+            else:
+                self.cancelled.add(job_id)
+
+
+def check_interrupt(value, total, preview_image):
+    """
+    Progress hook that stops sampling once the running job was cancelled.
+    """
+    comfy.model_management.throw_exception_if_processing_interrupted()
+
+
+def read_jobs(conn, jobs: JobQueue, running: RunningJob, send) -> None:
+    """
+    Receives messages from the client and updates the job queue.
+    """
+    try:
+        while True:
+            message = conn.recv()
+            if message[0] == "submit":
+                jobs.put(*message[1:])
+            elif message[0] == "cancel":
+                if jobs.cancel(message[1]):
+                    send(("cancelled", message[1], None))
+                else:
+                    running.interrupt(message[1])
+            elif message[0] == "reprioritize":
+                jobs.reprioritize(message[1], message[2])
+            elif message[0] == "shutdown":
+                jobs.close("shutdown")
+                return
+    except (EOFError, OSError):
+        pass
+    jobs.close(None)
+
+
+def serve(conn) -> bool:
+    """
+    Runs jobs for one client connection until it disconnects.
+    Returns False if the client asked the worker to shut down.
+    """
+    jobs = JobQueue()
+    running = RunningJob()
+    send_lock = threading.Lock()
+
+    def send(reply):
+        with send_lock:
+            conn.send(reply)
+
+    reader = threading.Thread(target=read_jobs, args=(conn, jobs, running, send), daemon=True)
+    reader.start()
+    while True:
+        job = jobs.get()
+        if job is None:
+            return True
+        if job == "shutdown":
+            return False
+        job_id, kind, payload = job
+        running.start(job_id)
+        try:
+            saved_paths = JOB_HANDLERS[kind](payload)
+            reply = ("done", job_id, saved_paths)
+        except comfy.model_management.InterruptProcessingException:
+            print(f"Job {job_id} interrupted")
+            reply = ("cancelled", job_id, None)
+        except Exception as e:
+            traceback.print_exc()
+            reply = ("error", job_id, f"{type(e).__name__}: {e}")
+        finally:
+            running.finish()
+        try:
+            send(reply)
+        except OSError:
+            return True
+
+
+def main():
+    comfy.utils.set_progress_bar_global_hook(check_interrupt)
+    with Listener((worker_args.worker_host, worker_args.worker_port), authkey=AUTHKEY) as listener:
+        print(f"Generation worker listening on {worker_args.worker_host}:{worker_args.worker_port}")
+        while True:
+            conn = listener.accept()
+            with conn:
+                keep_running = serve(conn)
+            if not keep_running:
+                break
+
+
+if __name__ == "__main__":
+    main()
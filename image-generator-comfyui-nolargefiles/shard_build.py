@@ -0,0 +1,117 @@
+"""
+Runs build_assets.py as K worker processes for CPU-only generation hosts.
+
+Torch's intra-op parallelism stops scaling at around 8 threads for 512x512 UNet steps,
+so one process can't keep a large CPU busy. This runner splits the manifest's assets
+across K processes ("--shard I/K", every K-th asset), each limited to --threads torch
+threads, then merges their links into <store>/index.json and sums their counters.
+Workers run with --mmap-weights and --lora-mmap. The unet weights of a checkpoint are
+then kept in the dtype they are stored in (fp16 for the manifest's checkpoints, cast to
+fp32 at compute time on CPU) as views of the same mmapped file in every process, and the
+LoRA files are shared the same way. What each worker still holds privately: the unet
+weights patched by the expression LoRA it is currently rendering (in fp32, as without
+--mmap-weights, so a sharded store has the same pixels as an unsharded one; restored to
+the shared ones when the LoRA changes), and the text encoder and VAE.
+Like build_assets.py, a run that was interrupted can simply be re-run.
+
+Run command (any extra arguments are passed on to the workers and ComfyUI):
+    .\\python_embeded\\python.exe -s shard_build.py assets_manifest.json --store asset_store --shards 4 --cpu
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Threads per worker beyond which a single UNet step barely gets faster
+MAX_USEFUL_THREADS = 8
+
+
+def default_threads(shards):
+    return max(1, min(MAX_USEFUL_THREADS, (os.cpu_count() or 1) // shards))
+
+
+def run_shards(args, extra_args):
+    """
+    Starts the workers, waits for all of them and returns their exit codes.
+    """
+    shard_dir = os.path.join(args.store, "shards")
+    for old in glob.glob(os.path.join(shard_dir, "shard-*.json")):
+        os.remove(old)
+
+    workers = []
+    for i in range(args.shards):
+        command = [
+            sys.executable, "-s", os.path.join(os.path.dirname(os.path.abspath(__file__)), "build_assets.py"), args.manifest,
+            "--store", args.store,
+            "--shard", f"{i}/{args.shards}",
+            "--threads", str(args.threads),
+            "--mmap-weights",
+            "--lora-mmap",
+        ] + extra_args
+        env = dict(os.environ, OMP_NUM_THREADS=str(args.threads), MKL_NUM_THREADS=str(args.threads))
+        workers.append(subprocess.Popen(command, env=env))
+    return [worker.wait() for worker in workers]
+
+
+def merge_reports(store):
+    """
+    Adds every worker's links to the store's index.json and returns the worker reports.
+    """
+    index_path = os.path.join(store, "index.json")
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    reports = []
+    for path in sorted(glob.glob(os.path.join(store, "shards", "shard-*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        index.update(report["links"])
+        reports.append(report)
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(index_path + ".tmp", index_path)
+    return reports
+
+
+def print_summary(reports, seconds):
+    totals = {"built": 0, "skipped": 0}
+    cache = {}
+    for report in reports:
+        rate = report["built"] / (report["seconds"] / 60) if report["seconds"] > 0 else 0.0
+        print(
+            f"shard {report['shard']}: built {report['built']}, skipped {report['skipped']}"
+            f" with {report['threads']} threads ({rate:.2f} images/min)"
+        )
+        totals["built"] += report["built"]
+        totals["skipped"] += report["skipped"]
+        for key, value in report["lora_cache"].items():
+            cache[key] = cache.get(key, 0) + value
+    minutes = seconds / 60
+    print(
+        f"total: built {totals['built']} images in {minutes:.1f} min"
+        f" ({totals['built'] / minutes:.2f} images/min), skipped {totals['skipped']}, LoRA cache {cache}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("manifest", type=str, help="JSON or YAML manifest of the assets to build.")
+    parser.add_argument("--store", type=str, default="asset_store", help="Content-addressed output directory.")
+    parser.add_argument("--shards", type=int, default=2, help="Number of worker processes.")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default: cores / shards, at most 8).")
+    args, extra_args = parser.parse_known_args()
+    if args.threads is None:
+        args.threads = default_threads(args.shards)
+
+    t = time.time()
+    codes = run_shards(args, extra_args)
+    reports = merge_reports(args.store)
+    print_summary(reports, time.time() - t)
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"shards {failed} failed, re-run to finish their assets")
+        sys.exit(1)
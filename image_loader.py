@@ -0,0 +1,172 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import threading
+
+from PIL import Image, ImageTk
+
+THUMBNAIL_CACHE_DIR = ".thumbnail_cache"
+
+
+def resize_image_aspect_ratio(image, max_width, max_height, resample=Image.BICUBIC):
+    """
+    Resize an image while maintaining its aspect ratio.
+
+    Args:
+        image (PIL.Image): The original image.
+        max_width (int): Maximum width the image should have after resizing.
+        max_height (int): Maximum height the image should have after resizing.
+        resample (PIL.Image.Resampling): The resampling filter to use.
+
+    Returns:
+        PIL.Image: The resized image.
+    """
+    original_width, original_height = image.size
+    ratio = min(max_width / original_width, max_height / original_height)
+    new_width = int(original_width * ratio)
+    new_height = int(original_height * ratio)
+    resized_image = image.resize((new_width, new_height), resample=resample)
+
+    return resized_image
+
+
+def fitted_size(image_size, max_width, max_height):
+    width, height = image_size
+    ratio = min(max_width / width, max_height / height)
+    return int(width * ratio), int(height * ratio)
+
+
+def decode_reduced(path, max_width, max_height):
+    """
+    Decodes an image at the smallest resolution that still covers the target size.
+
+    JPEGs are decoded with draft mode, which lets libjpeg scale by 1/2, 1/4 or 1/8 while
+    decoding. Other formats are decoded fully and then shrunk by an integer factor with
+    reduce(), which is much cheaper than a bicubic resize of the full image.
+    """
+    image = Image.open(path)
+    target = fitted_size(image.size, max_width, max_height)
+    if image.format == "JPEG":
+        image.draft("RGB", target)
+    image.load()
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA")
+    factor = min(image.size[0] // max(target[0], 1), image.size[1] // max(target[1], 1))
+    if factor >= 2:
+        image = image.reduce(factor)
+    return resize_image_aspect_ratio(image, max_width, max_height)
+
+
+class ImageLoader:
+    """
+    Decodes and resizes images on a worker pool and hands ready PhotoImages to the Tk thread.
+
+    Thumbnails are cached in memory and on disk, keyed by (path, mtime, target size), so
+    an image is decoded at full resolution at most once per size. Thumbnails of the same
+    file form a pyramid: a smaller size is derived from a cached larger one instead of
+    the original file.
+    """
+
+    def __init__(self, app, cache_dir=THUMBNAIL_CACHE_DIR, max_workers=2, memory_items=32):
+        self.app = app
+        self.cache_dir = cache_dir
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-loader")
+        self.lock = threading.Lock()
+        self.memory_items = memory_items
+        self.thumbnails = OrderedDict()  # (path, mtime, width, height) -> PIL.Image
+        self.photos = OrderedDict()  # same key -> PhotoImage, only touched on the Tk thread
+
+    def load(self, path, max_width, max_height, callback):
+        """
+        Loads path scaled to fit max_width x max_height and calls callback(photo_image)
+        on the Tk thread. Must be called from the Tk thread.
+        """
+        path = os.path.abspath(path)
+        try:
+            key = (path, os.stat(path).st_mtime_ns, max_width, max_height)
+        except OSError as e:
+            raise FileNotFoundError(f"Cannot open image {path}") from e
+        photo = self.photos.get(key)
+        if photo is not None:
+            self.photos.move_to_end(key)
+            callback(photo)
+            return
+        future = self.executor.submit(self.get_thumbnail, key)
+        future.add_done_callback(
+            lambda f: self.app.after(0, self.deliver, key, f, callback)
+        )
+
+    def deliver(self, key, future, callback):
+        """
+        Turns a finished thumbnail into a PhotoImage. Runs on the Tk thread.
+        """
+        try:
+            image = future.result()
+        except Exception as e:
+            print(f"Failed to load image {key[0]}: {e}")
+            return
+        photo = ImageTk.PhotoImage(image)
+        self.photos[key] = photo
+        if len(self.photos) > self.memory_items:
+            self.photos.popitem(last=False)
+        callback(photo)
+
+    def get_thumbnail(self, key):
+        """
+        Returns the thumbnail for key from memory, disk, a larger cached level or the source file.
+        Runs on the worker pool.
+        """
+        with self.lock:
+            image = self.thumbnails.get(key)
+            if image is not None:
+                self.thumbnails.move_to_end(key)
+                return image
+            larger = self.find_larger(key)
+
+        path, mtime, max_width, max_height = key
+        cache_path = self.cache_path(key)
+        if os.path.exists(cache_path):
+            image = Image.open(cache_path)
+            image.load()
+        elif larger is not None:
+            image = resize_image_aspect_ratio(larger, max_width, max_height)
+        else:
+            image = decode_reduced(path, max_width, max_height)
+            self.write_cache(cache_path, image)
+
+        with self.lock:
+            self.thumbnails[key] = image
+            if len(self.thumbnails) > self.memory_items:
+                self.thumbnails.popitem(last=False)
+        return image
+
+    def find_larger(self, key):
+        """
+        Returns a cached thumbnail of the same file that covers the requested size. Call with the lock held.
+        """
+        path, mtime, max_width, max_height = key
+        best = None
+        for (other_path, other_mtime, width, height), image in self.thumbnails.items():
+            if other_path != path or other_mtime != mtime:
+                continue
+            if width >= max_width and height >= max_height:
+                if best is None or image.size[0] < best.size[0]:
+                    best = image
+        return best
+
+    def cache_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".png")
+
+    def write_cache(self, cache_path, image):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            image.save(tmp_path, format="PNG", compress_level=1)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Failed to write thumbnail cache {cache_path}: {e}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
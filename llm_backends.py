@@ -0,0 +1,187 @@
+"""
+Pluggable chat model backends for DnDGameMaster.
+
+create_llm() returns the live Ollama model by default. Setting DND_LLM_CACHE to a
+directory puts a content-addressed response cache in front of it, and setting
+DND_LLM_BACKEND=replay swaps the model for ReplayChatModel, which answers from the
+responses recorded in that cache without any network access.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
+from typing import Any, List, Optional
+
+from langchain_community.chat_models import ChatOllama
+from langchain_core.caches import BaseCache
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.load import dumps, loads
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+# How long Ollama keeps the model (and the KV cache of the last prompt) loaded between turns
+OLLAMA_KEEP_ALIVE = "30m"
+DEFAULT_MODEL = "llama2"
+
+
+def cache_key(llm_string, prompt):
+    """
+    Content address of a response: the model with its sampling parameters, and the rendered prompt.
+    """
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+
+class DiskResponseCache(BaseCache):
+    """
+    LangChain cache that stores one JSON file per response in a directory.
+
+    Entries are keyed by cache_key(llm_string, prompt), where LangChain's llm_string
+    covers the model and its sampling parameters and prompt is the serialized message
+    list. The least recently used entries are deleted once there are more than
+    max_entries; file mtimes keep the LRU order across restarts.
+    """
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".json"):
+                entries.append((entry.stat().st_mtime, entry.name[: -len(".json")]))
+        self.keys = OrderedDict((key, None) for _, key in sorted(entries))
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def lookup(self, prompt: str, llm_string: str):
+        key = cache_key(llm_string, prompt)
+        with self.lock:
+            if key not in self.keys:
+                return None
+            self.keys.move_to_end(key)
+        try:
+            with open(self.entry_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(self.entry_path(key))
+        except (OSError, ValueError):
+            with self.lock:
+                self.keys.pop(key, None)
+            return None
+        return [loads(generation) for generation in entry["generations"]]
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        key = cache_key(llm_string, prompt)
+        entry = {
+            "llm_string": llm_string,
+            "prompt": prompt,
+            "response": "".join(generation.text for generation in return_val),
+            "generations": [dumps(generation) for generation in return_val],
+        }
+        tmp_path = self.entry_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.entry_path(key))
+        with self.lock:
+            self.keys[key] = None
+            self.keys.move_to_end(key)
+            evicted = []
+            while len(self.keys) > self.max_entries:
+                evicted.append(self.keys.popitem(last=False)[0])
+        for old_key in evicted:
+            try:
+                os.remove(self.entry_path(old_key))
+            except OSError:
+                pass
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            keys = list(self.keys)
+            self.keys.clear()
+        for key in keys:
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Offline stand-in for the Game Master's model that replays recorded responses.
+
+    Recordings are the entries of a DiskResponseCache directory. A prompt that was
+    recorded gets its recorded response back, whatever model recorded it. Any other
+    prompt gets the recordings in order, or default_response when there are none.
+    Responses are streamed word by word through the callbacks like a live model.
+    """
+
+    recordings_dir: Optional[str] = None
+    default_response: str = "The Game Master ponders your words. What do you do next?"
+    responses: dict = {}
+    sequence: List[str] = []
+    position: int = 0
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        if self.recordings_dir is None or not os.path.isdir(self.recordings_dir):
+            return
+        entries = []
+        for entry in os.scandir(self.recordings_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            with open(entry.path, "r", encoding="utf-8") as f:
+                recording = json.load(f)
+            entries.append((entry.stat().st_mtime, recording["prompt"], recording["response"]))
+        entries.sort()
+        self.responses = {prompt: response for _, prompt, response in entries}
+        self.sequence = [response for _, _, response in entries]
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def next_response(self, messages: List[BaseMessage]) -> str:
+        response = self.responses.get(dumps(messages))
+        if response is not None:
+            return response
+        if not self.sequence:
+            return self.default_response
+        response = self.sequence[self.position % len(self.sequence)]
+        self.position += 1
+        return response
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        response = self.next_response(messages)
+        if run_manager is not None:
+            for i, word in enumerate(response.split(" ")):
+                run_manager.on_llm_new_token(word if i == 0 else " " + word)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=response))])
+
+
+def create_llm(backend=None, cache_dir=None, model=DEFAULT_MODEL):
+    """
+    Builds the Game Master's chat model.
+
+    backend is "ollama" (the default) or "replay"; cache_dir enables the on-disk response
+    cache for the live model and is where the replay backend reads its recordings from.
+    Both default to the DND_LLM_BACKEND and DND_LLM_CACHE environment variables.
+    """
+    if backend is None:
+        backend = os.environ.get("DND_LLM_BACKEND", "ollama")
+    if cache_dir is None:
+        cache_dir = os.environ.get("DND_LLM_CACHE")
+
+    if backend == "replay":
+        return ReplayChatModel(recordings_dir=cache_dir)
+    if backend != "ollama":
+        raise ValueError(f"Unknown LLM backend: {backend}")
+    cache = DiskResponseCache(cache_dir) if cache_dir else None
+    return ChatOllama(model=model, keep_alive=OLLAMA_KEEP_ALIVE, cache=cache)
@@ -2,7 +2,7 @@ import tkinter as tk
 from tkinter import Label, scrolledtext, messagebox, filedialog, ttk
 import threading
 import os
-from PIL import Image, ImageTk
+from concurrent.futures import CancelledError
 #import sys
 
 #sys.path.append("D:\\Fake Desktop\\Fake Desktop\\PROJECTS\\AI ART\\TechFestGroup118")
@@ -10,14 +10,24 @@ from PIL import Image, ImageTk
 
 #import generate_portraits
 #import generate_background
-from DnDGameClasses import DnDGameMaster
+from DnDGameClasses import DnDGameMaster, WORLD_BACKGROUNDS
+from generation_client import BackgroundPrefetcher, GenerationClient
+from output_index import OutputIndex
+from scene_art import SceneArtPipeline
+from session_store import SessionStore
+from chat_view import ChatView
+from image_loader import ImageLoader
+from task_scheduler import TaskScheduler
+
+# How often streamed tokens are pushed into the chat history, in milliseconds
+STREAM_FLUSH_INTERVAL_MS = 50
 
 
 def display_prompt(message):
     messagebox.showinfo("Prompt", message)
 
 
-def run_generate_portraits():
+def run_generate_portraits(token=None):
     display_prompt("Generating portrait with preset prompts...")
     try:
         test_json = {
@@ -26,60 +36,71 @@ def run_generate_portraits():
                 "boy",
             ]
         }
-        #generate_portraits.main(test_json)
-        os.system(".\image_generator_comfyui\python_embeded\python.exe -s .\image_generator_comfyui\generate_portraits.py")
+        # None runs the presets at the bottom of generate_portraits.py
+        future = generation_client.submit("portraits", None)
+        if token is not None:
+            token.on_cancel(lambda: generation_client.cancel(future))
+        saved_paths = future.result()
+        show_generated_images(saved_paths)
         messagebox.showinfo("Success", "Portrait generation completed successfully.")
+    except CancelledError:
+        pass
     except Exception as e:
         messagebox.showerror("Error", f"Failed to generate portrait. Error: {str(e)}")
 
 
-def run_generate_backgrounds():
+def run_generate_backgrounds(token=None):
     display_prompt("Generating background with preset prompts...")
     try:
-        #generate_background.main()  # Add appropriate arguments as needed
-        os.system(".\image_generator_comfyui\python_embeded\python.exe -s .\image_generator_comfyui\generate_background.py")
+        # None runs the presets at the bottom of generate_background.py
+        future = generation_client.submit("backgrounds", None)
+        if token is not None:
+            token.on_cancel(lambda: generation_client.cancel(future))
+        saved_paths = future.result()
+        show_generated_images(saved_paths)
         messagebox.showinfo("Success", "Background generation completed successfully.")
+    except CancelledError:
+        pass
     except Exception as e:
         messagebox.showerror("Error", f"Failed to generate background. Error: {str(e)}")
 
 
-def display_image(image_path):
-    global photo_image  # Prevent the image from being garbage-collected
-    image = Image.open(image_path)
-    image = resize_image_aspect_ratio(image, 800, 600)
-    photo_image = ImageTk.PhotoImage(image)
-    image_label.config(image=photo_image)
-    image_label.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
-
-
-def resize_image_aspect_ratio(image, max_width, max_height, resample=Image.BICUBIC):
+def show_generated_images(saved_paths):
     """
-    Resize an image while maintaining its aspect ratio.
+    Records freshly generated images in the output index and displays the last one.
+    Safe to call from any thread.
+    """
+    for path in saved_paths:
+        output_index.add(path)
+    app.after(0, display_image, saved_paths[-1])
 
-    Args:
-        image (PIL.Image): The original image.
-        max_width (int): Maximum width the image should have after resizing.
-        max_height (int): Maximum height the image should have after resizing.
-        resample (PIL.Image.Resampling): The resampling filter to use.
 
-    Returns:
-        PIL.Image: The resized image.
+def display_image(image_path):
     """
-    original_width, original_height = image.size
-    ratio = min(max_width / original_width, max_height / original_height)
-    new_width = int(original_width * ratio)
-    new_height = int(original_height * ratio)
-    resized_image = image.resize((new_width, new_height), resample=resample)
+    Shows an image in the image panel. Decoding and resizing happen on the image loader's
+    worker pool; only the newest request is displayed when several overlap.
+    """
+    global display_request
+    display_request += 1
+    request = display_request
+
+    def show_photo(loaded_photo):
+        global photo_image  # Prevent the image from being garbage-collected
+        if request != display_request:
+            return
+        photo_image = loaded_photo
+        image_label.config(image=photo_image)
+        image_label.grid(row=0, column=1, padx=10, pady=10, sticky="nsew")
 
-    return resized_image
+    image_loader.load(image_path, 800, 600, show_photo)
 
 
 def select_latest_image():
-    output_folder = "image_generator_comfyui/ComfyUI/output"
     try:
-        # List all files in the output folder and find the newest (last modified) image
-        files = [os.path.join(output_folder, f) for f in os.listdir(output_folder)]
-        latest_image = max(files, key=os.path.getmtime)
+        # The index only rescans the output folder when its contents changed
+        latest_image = output_index.latest()
+        if latest_image is None:
+            raise FileNotFoundError("no generated images yet")
         display_image(latest_image)
     except Exception as e:
         messagebox.showerror(
@@ -87,14 +108,81 @@ def select_latest_image():
         )
 
 
-def fetch_response_and_update_ui(message):
+class ResponseStream:
+    """
+    Coalesces tokens streamed from the chat model into batches for the UI thread.
+
+    put() may be called from any thread. At most one flush is queued on the Tk event
+    loop at a time, so the UI sees one insert every STREAM_FLUSH_INTERVAL_MS instead
+    of one per token.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flush_scheduled = False
+        self.started = False
+
+    def put(self, token):
+        with self.lock:
+            self.pending.append(token)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        app.after(STREAM_FLUSH_INTERVAL_MS, self.flush)
+
+    def flush(self):
+        """
+        Inserts all pending tokens into the chat history. Runs on the UI thread.
+        """
+        with self.lock:
+            text = "".join(self.pending)
+            self.pending = []
+            self.flush_scheduled = False
+        if not text:
+            return
+        if not self.started:
+            begin_ai_chat_history()
+            self.started = True
+        append_ai_chat_history(text)
+
+    def finish(self, response, seq=None):
+        """
+        Completes the streamed message. Replies that never streamed (e.g. validation
+        errors) are inserted whole. Runs on the UI thread.
+        """
+        self.flush()
+        if self.started:
+            end_ai_chat_history(seq)
+        else:
+            update_ai_chat_history(response, seq)
+
+
+def choose_world_background(message):
+    """
+    Tells the background prefetcher which world the player picked, before the Game Master replies.
+    """
+    try:
+        world = int(message)
+    except ValueError:
+        return
+    if world in WORLD_BACKGROUNDS:
+        background_prefetcher.choose(world)
+
+
+def fetch_response_and_update_ui(message, message_seq=None, token=None):
     """
     Fetches response from the chat model in a separate thread and updates the UI.
+    Tokens are streamed into the chat history while the reply is being generated.
     """
+    stream = ResponseStream()
+    if game_master.state == "world_selection":
+        choose_world_background(message)
     try:
-        response = game_master.process_input(message)
+        response = game_master.process_input(message, on_token=stream.put)
+        seq = session_store.save_reply(response, game_master, reply_to=message_seq)
         # This thread queues, allowing asynchronous calls to the UI
-        app.after(0, update_ai_chat_history, response)
+        app.after(0, stream.finish, response, seq)
     finally:
         app.after(0, reset_send_button)
 
@@ -120,35 +208,52 @@ def fetch_response_and_update_ui(message):
 #     chat_history.configure(state=tk.DISABLED)
 
 
-def update_ai_chat_history(ai_response):
+def update_ai_chat_history(ai_response, seq=None):
     """
-    Updates the chat history with the AI's response.
+    Updates the chat history with the AI's response. seq is the response's number in the
+    session store, so the chat view can page it back in after dropping it.
     """
-    chat_history.configure(state=tk.NORMAL)
+    chat_view.add_message("ai", ai_response, seq)
 
-    # Insert the AI's response with a different formatting
-    ai_response_formatted = f"Game Master: {ai_response}\n"
-    chat_history.insert(tk.END, ai_response_formatted, "ai")
 
-    chat_history.see(tk.END)  # Scroll to the bottom to see the latest messages
-    chat_history.configure(state=tk.DISABLED)
+def begin_ai_chat_history():
+    """
+    Starts a new AI message in the chat history that will be filled in by streamed tokens.
+    """
+    chat_view.begin_message("ai")
 
 
-def update_user_chat_history(user_message):
+def append_ai_chat_history(text):
     """
-    Updates the chat history with the user's message.
+    Appends streamed text to the AI message started by begin_ai_chat_history.
+    """
+    chat_view.append_text(text, "ai")
+
+
+def end_ai_chat_history(seq=None):
+    """
+    Terminates the streamed AI message.
     """
-    chat_history.configure(state=tk.NORMAL)
+    chat_view.end_message(seq, "ai")
 
-    # Insert the user's message with a specific formatting
-    user_message_formatted = f"\nYou: {user_message}\n"
-    chat_history.insert(tk.END, user_message_formatted, "user")
 
-    chat_history.see(tk.END)  # Scroll to the bottom to see the latest messages
-    chat_history.configure(state=tk.DISABLED)
+def update_user_chat_history(user_message, seq=None):
+    """
+    Updates the chat history with the user's message.
+    """
+    chat_view.add_message("user", user_message, seq)
 
 
 def start_game():
+    # Pick up the saved session, if any, without calling the model again
+    session_store.restore(game_master)
+    chat_view.load_latest()
+
+    # Render every world's background while the player is still reading the menu
+    background_prefetcher.start()
+    if game_master.state != "world_selection":
+        background_prefetcher.choose(game_master.world_choice)
+        return
     update_ai_chat_history(
         "Welcome to AI Dungeons & Dragons! \n\n Please choose a world setting for your DnD quest:\n\n1. The Shattered Isles \n2. Jungle World \n3. The Frozen Wastes"
     )
@@ -163,8 +268,9 @@ def send_message():
     if message:
         send_button.config(state=tk.DISABLED, text="Loading...")  # Indicate loading
         user_input.delete("1.0", tk.END)  # Clear the input after sending the message
-        update_user_chat_history(message)
-        threading.Thread(target=fetch_response_and_update_ui, args=(message,)).start()
+        seq = session_store.save_user_message(message)
+        update_user_chat_history(message, seq)
+        task_scheduler.submit("chat", fetch_response_and_update_ui, message, seq)
 
 
 def on_send_message_click(event=None):
@@ -172,8 +278,27 @@ def on_send_message_click(event=None):
 
 
 game_master = DnDGameMaster()
+generation_client = GenerationClient()
+task_scheduler = TaskScheduler()
+background_prefetcher = BackgroundPrefetcher(
+    generation_client,
+    WORLD_BACKGROUNDS,
+    on_ready=show_generated_images,
+)
+output_index = OutputIndex()
+# Renders backgrounds and portraits for what the narration describes, reusing existing art
+scene_art = SceneArtPipeline(
+    generation_client,
+    output_index,
+    WORLD_BACKGROUNDS,
+    on_ready=show_generated_images,
+)
+game_master.narration_listeners.append(scene_art.narrate)
+session_store = SessionStore()
 app = tk.Tk()
 app.title("AI Dungeons & Dragons")
+image_loader = ImageLoader(app)
+display_request = 0
 
 # Set the theme for light mode
 style = ttk.Style()
@@ -205,6 +330,8 @@ chat_history = scrolledtext.ScrolledText(
 chat_history.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
 chat_history.tag_configure("user", foreground="blue", font=("Helvetica", 14, ""))
 chat_history.tag_configure("ai", foreground="green", font=("Helvetica", 14, "bold"))
+# Keeps a bounded window of messages in the widget, paging older ones from the save
+chat_view = ChatView(chat_history, session_store)
 # User Input Box
 user_input = tk.Text(left_frame, height=3)
 user_input.grid(row=1, column=0, padx=10, pady=10, sticky="ew")
@@ -218,7 +345,10 @@ buttons_frame.grid(row=3, column=0, pady=5, sticky="ew")
 portrait_button = tk.Button(
     buttons_frame,
     text="Generate Portrait",
-    command=lambda: threading.Thread(target=run_generate_portraits).start(),
+    # Clicking again while a run is queued or in progress reuses that run
+    command=lambda: task_scheduler.submit(
+        "portraits", run_generate_portraits, key=("portraits", None)
+    ),
 )
 portrait_button.pack(side=tk.LEFT, padx=5)
 
@@ -226,7 +356,9 @@ portrait_button.pack(side=tk.LEFT, padx=5)
 background_button = tk.Button(
     buttons_frame,
     text="Generate Background",
-    command=lambda: threading.Thread(target=run_generate_backgrounds).start(),
+    command=lambda: task_scheduler.submit(
+        "backgrounds", run_generate_backgrounds, key=("backgrounds", None)
+    ),
 )
 background_button.pack(side=tk.LEFT, padx=5)
 
@@ -242,3 +374,8 @@ send_button.grid(row=2, column=0, pady=5, sticky="ew")
 
 start_game()
 app.mainloop()
+# Interrupts generation runs that are still in progress on the worker
+task_scheduler.shutdown()
+image_loader.shutdown()
+generation_client.close()
+session_store.close()
@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+
+OUTPUT_FOLDER = "image_generator_comfyui/ComfyUI/output"
+
+# SaveImage names its files "<filename_prefix>_<counter>_.png"
+SAVED_IMAGE_PATTERN = re.compile(r"^(?P<prefix>.+)_(?P<counter>\d{5})_\.png$")
+
+# Expression suffixes used by generate_portraits.py
+EXPRESSIONS = (
+    "neutral",
+    "happy",
+    "smug",
+    "angry",
+    "worried",
+    "embarassed",
+    "heart-eyed",
+    "starry-eyed",
+)
+
+
+def parse_image_name(filename):
+    """
+    Works out what a generated image shows from its file name.
+
+    Returns a dict with "kind" ("portrait", "background" or "other") and, where they
+    apply, the "character", "expression" and "world" (background name) of the image.
+    """
+    match = SAVED_IMAGE_PATTERN.match(filename)
+    if match is None:
+        return {"kind": "other"}
+    prefix = match.group("prefix")
+    if prefix.startswith("bg_"):
+        return {"kind": "background", "world": prefix[len("bg_"):]}
+    character, _, expression = prefix.rpartition("_")
+    if character and expression in EXPRESSIONS:
+        return {"kind": "portrait", "character": character, "expression": expression}
+    return {"kind": "other"}
+
+
+class OutputIndex:
+    """
+    Incremental index of the images in the ComfyUI output folder.
+
+    The folder is only listed again when its mtime changes, and then only new files are
+    stat'ed. Generated files can also be reported directly with add(). The newest image
+    overall and per (character, expression) and world are kept up to date, so the
+    "latest" lookups are O(1).
+    """
+
+    def __init__(self, folder=OUTPUT_FOLDER):
+        self.folder = os.path.abspath(folder)
+        self.lock = threading.Lock()
+        self.folder_mtime = None
+        self.entries = {}  # path -> (mtime, parsed name)
+        self.newest = None  # (mtime, path) of the newest image
+        self.newest_by_key = {}  # query key -> (mtime, path)
+
+    def refresh(self):
+        """
+        Picks up files that appeared or disappeared since the last call.
+        """
+        try:
+            folder_mtime = os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self.lock:
+            if folder_mtime == self.folder_mtime:
+                return
+            self.folder_mtime = folder_mtime
+            present = set()
+            for entry in os.scandir(self.folder):
+                if not entry.is_file():
+                    continue
+                present.add(entry.path)
+                if entry.path not in self.entries:
+                    self.insert(entry.path, entry.stat().st_mtime)
+            removed = [path for path in self.entries if path not in present]
+            for path in removed:
+                del self.entries[path]
+            if removed:
+                self.rebuild_newest()
+
+    def add(self, path):
+        """
+        Records a file reported by the generator without waiting for the next folder scan.
+        """
+        path = os.path.abspath(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return
+        with self.lock:
+            if path not in self.entries:
+                self.insert(path, mtime)
+
+    def insert(self, path, mtime):
+        """
+        Adds a file and updates the newest entries. Call with the lock held.
+        """
+        info = parse_image_name(os.path.basename(path))
+        self.entries[path] = (mtime, info)
+        self.update_newest(path, mtime, info)
+
+    def update_newest(self, path, mtime, info):
+        candidate = (mtime, path)
+        if self.newest is None or candidate > self.newest:
+            self.newest = candidate
+        for key in self.query_keys(info):
+            if key not in self.newest_by_key or candidate > self.newest_by_key[key]:
+                self.newest_by_key[key] = candidate
+
+    def rebuild_newest(self):
+        self.newest = None
+        self.newest_by_key = {}
+        for path, (mtime, info) in self.entries.items():
+            self.update_newest(path, mtime, info)
+
+    @staticmethod
+    def query_keys(info):
+        """
+        Every (character, expression, world) query that an image answers, with None as a wildcard.
+        """
+        if info["kind"] == "portrait":
+            return [
+                ("portrait", None, None, None),
+                ("portrait", info["character"], None, None),
+                ("portrait", None, info["expression"], None),
+                ("portrait", info["character"], info["expression"], None),
+            ]
+        if info["kind"] == "background":
+            return [
+                ("background", None, None, None),
+                ("background", None, None, info["world"]),
+            ]
+        return []
+
+    def latest(self, character=None, expression=None, world=None):
+        """
+        Returns the path of the newest image matching the query, or None.
+
+        With no arguments this is the newest image of any kind. character and expression
+        select portraits, world selects backgrounds.
+        """
+        self.refresh()
+        with self.lock:
+            if character is None and expression is None and world is None:
+                newest = self.newest
+            elif world is not None:
+                newest = self.newest_by_key.get(("background", None, None, world))
+            else:
+                newest = self.newest_by_key.get(("portrait", character, expression, None))
+        return newest[1] if newest is not None else None
+
+    def images(self, character=None, expression=None, world=None):
+        """
+        Returns the paths of every image matching the query, newest first.
+        """
+        self.refresh()
+        matches = []
+        with self.lock:
+            for path, (mtime, info) in self.entries.items():
+                if character is not None and info.get("character") != character:
+                    continue
+                if expression is not None and info.get("expression") != expression:
+                    continue
+                if world is not None and info.get("world") != world:
+                    continue
+                matches.append((mtime, path))
+        return [path for mtime, path in sorted(matches, reverse=True)]
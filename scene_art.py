@@ -0,0 +1,200 @@
+import re
+import threading
+
+from generation_client import PRIORITY_HIGH, PRIORITY_PREFETCH
+
+# Scene key -> (words or phrases that point to the scene, background prompt). Words that are
+# common outside a scene ("keep", "mine", "pass", "bar") only count as part of a phrase.
+SCENE_KEYWORDS = {
+    "tavern": (("tavern", "inn", "alehouse", "taproom", "barkeep", "the bar", "mug of ale", "mead"), "inside a bustling medieval tavern, wooden tables, warm firelight"),
+    "shop": (("shop", "shopkeeper", "storefront", "wares", "potions", "the store", "the counter"), "inside a cozy shop, shelves stacked with goods and wares"),
+    "market": (("market", "marketplace", "bazaar", "vendors", "stalls", "market square", "town square"), "busy market square with colorful stalls and banners"),
+    "city": (("city", "town", "village", "streets", "alley", "alleys", "the street", "city gates", "city walls"), "cityscape with medieval european buildings and architecture"),
+    "castle": (("castle", "throne", "palace", "fortress", "citadel", "battlements", "the keep", "great hall"), "grand castle hall with high stone arches and banners"),
+    "temple": (("temple", "shrine", "altar", "chapel", "monastery", "sanctuary"), "ancient temple with stone pillars and a glowing altar"),
+    "dungeon": (("dungeon", "prison", "crypt", "tomb", "catacombs", "sewer", "sewers", "prison cell"), "dark dungeon corridor with torches on damp stone walls"),
+    "cave": (("cave", "cavern", "caverns", "tunnel", "tunnels", "underground", "grotto", "mine shaft", "the mines"), "deep cavern with glowing crystals and stalactites"),
+    "forest": (("forest", "woods", "trees", "grove", "thicket", "glade", "forest clearing"), "clearing in a forest, peaceful and serene woods"),
+    "mountain": (("mountain", "mountains", "peak", "cliff", "cliffs", "summit", "mountain pass"), "tall snow-capped mountains, with trees and rocks"),
+    "desert": (("desert", "dunes", "sand", "oasis"), "a desert landscape with rocks and sand"),
+    "swamp": (("swamp", "marsh", "bog", "mire", "fen"), "misty swamp with twisted trees and murky water"),
+    "harbor": (("harbor", "harbour", "docks", "pier", "wharf", "seaport", "the port", "the dock"), "harbor with wooden docks and moored sailing ships"),
+    "ship": (("ship", "airship", "vessel", "sails", "galleon", "rigging", "the deck"), "on the deck of a sailing ship, rigging and sails"),
+    "camp": (("camp", "campfire", "tent", "tents", "bonfire"), "campsite at night around a crackling campfire"),
+    "battlefield": (("battle", "battlefield", "army", "siege", "soldiers"), "battlefield with smoke, banners and broken weapons"),
+}
+
+# Character key -> (words or phrases that point to the character, portrait prompt)
+CHARACTER_KEYWORDS = {
+    "Innkeeper": (("innkeeper", "barkeep", "bartender", "tavernkeeper"), "Middle-aged innkeeper, apron, friendly face, stubble"),
+    "Merchant": (("merchant", "shopkeeper", "trader", "peddler", "vendor"), "Merchant, fine clothes, trimmed beard, gold rings"),
+    "Guard": (("guards", "guardsman", "guardsmen", "soldier", "sentry", "watchman", "the guard", "city guard"), "City guard, steel helmet, chainmail, stern face"),
+    "Knight": (("knight", "paladin"), "Knight in shining plate armor, noble face, short hair"),
+    "Wizard": (("wizard", "mage", "sorcerer", "archmage", "warlock"), "Old wizard, long white beard, pointed hat, blue robe"),
+    "Priest": (("priest", "priestess", "cleric"), "Priest, white and gold vestments, calm face, holy symbol"),
+    "Rogue": (("thief", "rogue", "bandit", "assassin", "pickpocket"), "Rogue, dark hood, scar across cheek, sly grin"),
+    "Noble": (("prince", "princess", "duke", "duchess", "nobleman", "noblewoman", "the king", "the queen"), "Noble, ornate crown, regal clothes, proud expression"),
+    "Pirate": (("pirate", "pirates", "buccaneer", "pirate captain", "sea captain"), "Pirate captain, tricorn hat, eyepatch, long coat"),
+    "Elf": (("elf", "elven", "elves"), "Elf, pointed ears, long silver hair, green cloak"),
+    "Dwarf": (("dwarf", "dwarven", "dwarves"), "Dwarf, braided red beard, iron helmet, stocky"),
+}
+
+# A scene is only rendered when its keywords occur this often, and more often than
+# those of any other scene; a passing mention is not worth a background render.
+MIN_SCENE_SCORE = 2
+
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+
+def count_keyword(words, counts, keyword):
+    parts = keyword.split()
+    if len(parts) == 1:
+        return counts.get(keyword, 0)
+    n = len(parts)
+    return sum(1 for i in range(len(words) - n + 1) if words[i:i + n] == parts)
+
+
+def classify_narration(text, max_characters=2):
+    """
+    Pulls the scene and the characters described in a piece of narration.
+
+    Every scene and character is scored by how many of its keywords occur in the text.
+    The best scene only counts if it scores at least MIN_SCENE_SCORE and beats the
+    runner-up. Returns (scene key or None, list of character keys), best matches first.
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    counts = {}
+    for word in words:
+        counts[word] = counts.get(word, 0) + 1
+
+    def scores(table):
+        found = []
+        for key, (keywords, _) in table.items():
+            score = sum(count_keyword(words, counts, keyword) for keyword in keywords)
+            if score > 0:
+                found.append((score, key))
+        # Stable sort keeps table order between equal scores
+        found.sort(key=lambda item: -item[0])
+        return found
+
+    scenes = scores(SCENE_KEYWORDS)
+    scene = None
+    if scenes and scenes[0][0] >= MIN_SCENE_SCORE and (len(scenes) == 1 or scenes[0][0] > scenes[1][0]):
+        scene = scenes[0][1]
+    return scene, [key for _, key in scores(CHARACTER_KEYWORDS)[:max_characters]]
+
+
+class SceneArtPipeline:
+    """
+    Renders art for the scenes and characters that come up in the narration.
+
+    Hook narrate() to DnDGameMaster.narration_listeners. Each narration is classified
+    with classify_narration and mapped to the backgrounds/characters dicts used by
+    generate_background.py and generate_portraits.py. Descriptors are deduplicated by
+    their semantic key ((world, scene) or character), so an asset that is already in
+    the output folder or already queued is reused instead of rendered again. The
+    current scene is rendered at high priority and the previous scene drops to prefetch
+    priority, as do new characters.
+    """
+
+    def __init__(self, client, output_index, world_backgrounds, on_ready=None):
+        self.client = client
+        self.output_index = output_index
+        self.world_backgrounds = world_backgrounds
+        self.on_ready = on_ready
+        self.lock = threading.Lock()
+        self.pending = {}  # semantic key -> future of the job rendering it, None while submitting
+        self.scene_future = None
+
+    def background_name(self, world_choice, scene):
+        world_name = next(iter(self.world_backgrounds[world_choice]))
+        return f"{world_name}_{scene}"
+
+    def background_job(self, world_choice, scene):
+        world_name, (world_prompt, negative) = next(
+            iter(self.world_backgrounds[world_choice].items())
+        )
+        name = self.background_name(world_choice, scene)
+        return {name: [f"{SCENE_KEYWORDS[scene][1]}, {world_prompt}", negative]}
+
+    def narrate(self, narration, world_choice):
+        """
+        Queues art for a piece of narration. Returns at once; submitting happens on its own
+        thread because the first submit waits for the generation worker.
+        """
+        if world_choice not in self.world_backgrounds:
+            return
+        scene, characters = classify_narration(narration)
+        if scene is None and not characters:
+            return
+        threading.Thread(
+            target=self.submit, args=(world_choice, scene, characters), daemon=True
+        ).start()
+
+    def submit(self, world_choice, scene, characters):
+        if scene is not None:
+            name = self.background_name(world_choice, scene)
+            existing = self.output_index.latest(world=name)
+            if existing is not None:
+                if self.on_ready is not None:
+                    self.on_ready([existing])
+            else:
+                self.submit_job(
+                    ("background", name),
+                    "backgrounds",
+                    self.background_job(world_choice, scene),
+                    PRIORITY_HIGH,
+                    scene=True,
+                )
+        for character in characters:
+            if self.output_index.latest(character=character, expression="neutral") is not None:
+                continue
+            # generate_portraits.py already adds its own negative prompt
+            self.submit_job(
+                ("portrait", character),
+                "portraits",
+                {character: [CHARACTER_KEYWORDS[character][1], ""]},
+                PRIORITY_PREFETCH,
+            )
+
+    def submit_job(self, key, kind, payload, priority, scene=False):
+        with self.lock:
+            if key in self.pending:
+                # None while another thread is still submitting it
+                if scene and self.pending[key] is not None and self.pending[key] is not self.scene_future:
+                    # Scene came back while still queued: make it the current one again
+                    previous, self.scene_future = self.scene_future, self.pending[key]
+                    self.client.reprioritize(self.scene_future, PRIORITY_HIGH)
+                    if previous is not None:
+                        self.client.reprioritize(previous, PRIORITY_PREFETCH)
+                return
+            # Reserve the key so that no other thread submits it while this one does
+            self.pending[key] = None
+        try:
+            future = self.client.submit(kind, payload, priority)
+        except Exception as e:
+            print(f"Failed to queue scene art: {e}")
+            with self.lock:
+                del self.pending[key]
+            return
+        with self.lock:
+            self.pending[key] = future
+            if scene:
+                previous, self.scene_future = self.scene_future, future
+        if scene and previous is not None:
+            # The player has moved on; render the old scene later for when they return
+            self.client.reprioritize(previous, PRIORITY_PREFETCH)
+        future.add_done_callback(lambda f: self.job_done(key, f, scene))
+
+    def job_done(self, key, future, scene):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return
+        for path in future.result():
+            self.output_index.add(path)
+        with self.lock:
+            current = scene and self.scene_future is future
+        if current and self.on_ready is not None:
+            self.on_ready(future.result())
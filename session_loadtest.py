@@ -0,0 +1,112 @@
+"""
+Load test for session_server.py against a stubbed model.
+
+Starts the server in-process with a chat model that sleeps for a fixed latency
+instead of calling Ollama, then drives 1, 10 and 100 concurrent sessions over TCP
+and reports the p50/p99 turn latency seen by the clients.
+
+Run command:
+    python session_loadtest.py [--turns 5] [--latency 0.05] [--max-concurrency 4]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from session_server import SessionServer, SharedLLMClient
+
+SESSION_COUNTS = (1, 10, 100)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Answers every prompt after a fixed delay, like a model with constant inference time.
+    """
+
+    latency: float = 0.05
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return self.reply(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self.reply(messages)
+
+    def reply(self, messages):
+        content = f"The story continues ({len(messages)} messages so far)."
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def play_session(port, session_id, turns, latencies):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    messages = [str(session_id % 3 + 1)] + [f"I explore further, step {i}" for i in range(1, turns)]
+    for message in messages:
+        request = {"session": f"player-{session_id}", "message": message}
+        t = time.perf_counter()
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - t)
+        if "response" not in reply:
+            raise RuntimeError(f"Server error: {reply}")
+    writer.close()
+
+
+async def run_load(sessions, args):
+    client = SharedLLMClient(StubChatModel(latency=args.latency), max_concurrency=args.max_concurrency)
+    server = await SessionServer(client).start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    latencies = []
+    t = time.perf_counter()
+    async with server:
+        await asyncio.gather(
+            *(play_session(port, i, args.turns, latencies) for i in range(sessions))
+        )
+    elapsed = time.perf_counter() - t
+    print(
+        f"{sessions:4d} sessions: p50 {percentile(latencies, 0.5) * 1000:8.1f} ms"
+        f"  p99 {percentile(latencies, 0.99) * 1000:8.1f} ms"
+        f"  {len(latencies) / elapsed:7.1f} turns/s"
+        f"  model calls {client.stats['model_calls']}/{client.stats['requests']}"
+        f" ({client.stats['coalesced']} coalesced)"
+    )
+
+
+async def main(args):
+    for sessions in SESSION_COUNTS:
+        await run_load(sessions, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session, including the world choice.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub model latency per call in seconds.")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Maximum number of model calls in flight.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,208 @@
+"""
+Multi-session Game Master server.
+
+Every player session gets its own DnDGameMaster (state, world and memory), while all
+LLM calls go through one SharedLLMClient that bounds the number of concurrent model
+requests, serves sessions round-robin and coalesces identical prompts.
+
+Protocol: one JSON object per line over TCP.
+    request:  {"session": "<id>", "message": "<player input>"}
+    response: {"session": "<id>", "response": "<Game Master reply>"}
+    error:    {"session": "<id>", "error": "<message>"} if the turn failed (e.g. the
+              model could not be reached), or {"error": "<message>"} for a bad request
+
+Run command:
+    python session_server.py --port 8790 --max-concurrency 4
+"""
+import argparse
+import asyncio
+from collections import OrderedDict, deque
+import json
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.load import dumps
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+
+from DnDGameClasses import DnDGameMaster
+from llm_backends import create_llm
+
+
+class SharedLLMClient:
+    """
+    Dispatches chat model calls from many sessions to one underlying model.
+
+    At most max_concurrency calls run at once. Waiting requests are kept in one queue
+    per session and dispatched round-robin, so a session with a backlog (e.g. memory
+    summaries) cannot starve the others. A request whose prompt is identical to one
+    already waiting or running shares its result instead of calling the model again.
+    Must be used from the event loop it was created on, except through call_threadsafe.
+    """
+
+    def __init__(self, llm, max_concurrency=4):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.loop = asyncio.get_running_loop()
+        self.queues = OrderedDict()  # session id -> deque of waiting requests
+        self.inflight = {}  # prompt key -> future shared by identical requests
+        self.active = 0
+        self.stats = {"requests": 0, "coalesced": 0, "model_calls": 0}
+
+    async def generate(self, session_id, messages, stop=None):
+        """
+        Returns the list of ChatGenerations for messages.
+        """
+        self.stats["requests"] += 1
+        key = dumps([messages, stop])
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            future = self.loop.create_future()
+            self.inflight[key] = future
+            self.queues.setdefault(session_id, deque()).append((key, messages, stop, future))
+            self.dispatch()
+        # Shielded so that one waiter giving up does not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def call_threadsafe(self, session_id, messages, stop=None):
+        """
+        Blocking version of generate for threads other than the event loop's.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.generate(session_id, messages, stop), self.loop
+        ).result()
+
+    def dispatch(self):
+        """
+        Starts waiting requests while there is capacity, one session at a time.
+        """
+        while self.active < self.max_concurrency and self.queues:
+            session_id, queue = self.queues.popitem(last=False)
+            request = queue.popleft()
+            if queue:
+                # Back of the line until every other session had its turn
+                self.queues[session_id] = queue
+            self.active += 1
+            self.loop.create_task(self.run(request))
+
+    async def run(self, request):
+        key, messages, stop, future = request
+        self.stats["model_calls"] += 1
+        try:
+            result = await self.llm.agenerate([messages], stop=stop)
+            future.set_result(result.generations[0])
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            del self.inflight[key]
+            self.active -= 1
+            self.dispatch()
+
+
+class SessionChatModel(BaseChatModel):
+    """
+    Chat model handed to a session's DnDGameMaster. Forwards every call to the shared
+    client under the session's id.
+    """
+
+    client: Any
+    session_id: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "shared-session"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Memory summaries run on a background thread and come in through here
+        generations = self.client.call_threadsafe(self.session_id, messages, stop)
+        return ChatResult(generations=generations)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        generations = await self.client.generate(self.session_id, messages, stop)
+        return ChatResult(generations=generations)
+
+
+class SessionServer:
+    """
+    Keeps one DnDGameMaster per session and runs their turns against a SharedLLMClient.
+    Turns of the same session are handled one at a time.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.sessions = {}
+        self.locks = {}
+
+    def get_session(self, session_id):
+        game_master = self.sessions.get(session_id)
+        if game_master is None:
+            llm = SessionChatModel(client=self.client, session_id=session_id)
+            game_master = DnDGameMaster(llm=llm, verbose=False)
+            self.sessions[session_id] = game_master
+            self.locks[session_id] = asyncio.Lock()
+        return game_master
+
+    async def handle_turn(self, session_id, message):
+        game_master = self.get_session(session_id)
+        async with self.locks[session_id]:
+            return await game_master.aprocess_input(message)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    session_id = str(request["session"])
+                    message = str(request["message"])
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {"error": f"Invalid request: {e}"}
+                else:
+                    try:
+                        response = await self.handle_turn(session_id, message)
+                        reply = {"session": session_id, "response": response}
+                    except Exception as e:
+                        # e.g. the model server is down; keep the connection for the next turn
+                        print(f"Turn failed for session {session_id}: {e}")
+                        reply = {"session": session_id, "error": str(e)}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+
+async def main(args):
+    client = SharedLLMClient(create_llm(), max_concurrency=args.max_concurrency)
+    server = await SessionServer(client).start(args.host, args.port)
+    print(f"Game Master session server listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Maximum number of model calls in flight.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,261 @@
+import glob
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+
+SAVE_DIR = os.path.join("saves", "default")
+
+SEGMENT_PATTERN = re.compile(r"^segment-(\d{6})\.jsonl(\.gz)?$")
+SNAPSHOT_PATTERN = re.compile(r"^snapshot-(\d{6})\.json$")
+
+
+def open_segment(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class SessionStore:
+    """
+    Append-only save file for a game session.
+
+    Every chat message is appended as one JSON line to the current log segment, so
+    saving a turn costs the same however long the campaign is. Every snapshot_every
+    messages the Game Master's state (game state, world and bounded memory) is written
+    to a snapshot and a new segment is started; sealed segments are gzipped when
+    compress is set. Restoring loads the newest snapshot and replays only the messages
+    logged after it, without calling the model again.
+
+    Message records look like {"seq": 12, "role": "user" | "ai", "text": "..."}. AI
+    records also carry the game state after the turn and whether the exchange was
+    stored in the Game Master's memory, and the seq of the player message they answer.
+    Call restore() before saving new turns.
+    """
+
+    def __init__(self, directory=SAVE_DIR, snapshot_every=50, compress=True):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.compress = compress
+        os.makedirs(directory, exist_ok=True)
+        self.segment = max(self.segment_numbers(), default=1)
+        self.next_seq = 0
+        self.records_in_segment = 0
+        self.log = None
+        self.lock = threading.RLock()
+        self.segment_starts = {}  # segment number -> seq of its first record
+
+    def segment_numbers(self):
+        numbers = set()
+        for name in os.listdir(self.directory):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                numbers.add(int(match.group(1)))
+        return sorted(numbers)
+
+    def segment_path(self, number):
+        """
+        Returns the path of a segment, preferring the plain file if a crash left both versions.
+        """
+        path = os.path.join(self.directory, f"segment-{number:06d}.jsonl")
+        if os.path.exists(path) or not os.path.exists(path + ".gz"):
+            return path
+        return path + ".gz"
+
+    def snapshot_path(self, number):
+        return os.path.join(self.directory, f"snapshot-{number:06d}.json")
+
+    def latest_snapshot(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = SNAPSHOT_PATTERN.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        if not numbers:
+            return None
+        with open(self.snapshot_path(max(numbers)), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def read_segment(self, number):
+        path = self.segment_path(number)
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open_segment(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # torn write after a crash
+        return records
+
+    def segment_start(self, number):
+        """
+        Returns the seq of the first record of a segment, or None if it has none yet.
+        """
+        if number not in self.segment_starts:
+            records = self.read_segment(number)
+            if not records:
+                return None
+            self.segment_starts[number] = records[0]["seq"]
+        return self.segment_starts[number]
+
+    def read_range(self, start, stop):
+        """
+        Returns the messages with start <= seq < stop, oldest first. Only the segments
+        holding them are read.
+        """
+        records = []
+        # Held so that a segment is not compressed away while it is being read
+        with self.lock:
+            numbers = self.segment_numbers()
+            for i, number in enumerate(numbers):
+                if i + 1 < len(numbers):
+                    next_start = self.segment_start(numbers[i + 1])
+                    if next_start is not None and next_start <= start:
+                        continue
+                first = self.segment_start(number)
+                if first is not None and first >= stop:
+                    break
+                records += [r for r in self.read_segment(number) if start <= r["seq"] < stop]
+        return records
+
+    def append(self, record):
+        """
+        Appends one message record and returns its sequence number.
+        """
+        with self.lock:
+            if self.log is None:
+                self.log = open(self.segment_path(self.segment), "a+", encoding="utf-8")
+                if self.log.tell() > 0:
+                    self.log.seek(self.log.tell() - 1)
+                    if self.log.read(1) != "\n":
+                        self.log.write("\n")  # terminate a line torn by a crash
+            record = dict(record, seq=self.next_seq)
+            self.log.write(json.dumps(record) + "\n")
+            self.log.flush()
+            self.next_seq += 1
+            self.records_in_segment += 1
+            return record["seq"]
+
+    def save_user_message(self, text):
+        """
+        Logs a player message and returns its seq.
+        """
+        return self.append({"role": "user", "text": text})
+
+    def save_reply(self, response, game_master, reply_to=None):
+        """
+        Logs the Game Master's reply to the player message with seq reply_to and returns
+        its seq, snapshotting when the segment is full.
+        """
+        with self.lock:
+            seq = self.append(
+                {
+                    "role": "ai",
+                    "text": response,
+                    "remembered": game_master.last_turn_remembered,
+                    "state": game_master.state,
+                    "world_choice": game_master.world_choice,
+                    "reply_to": reply_to,
+                }
+            )
+            if self.records_in_segment >= self.snapshot_every:
+                self.snapshot(game_master.get_state())
+        return seq
+
+    def save_turn(self, user_message, response, game_master):
+        """
+        Logs a player message and the Game Master's reply.
+        """
+        return self.save_reply(
+            response, game_master, reply_to=self.save_user_message(user_message)
+        )
+
+    def snapshot(self, state):
+        """
+        Writes a snapshot of the Game Master's state and starts a new log segment.
+        """
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+            sealed = self.segment
+            self.segment += 1
+            self.records_in_segment = 0
+            snapshot = {"seq": self.next_seq - 1, "segment": self.segment, "game_master": state}
+            tmp_path = self.snapshot_path(self.segment) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.snapshot_path(self.segment))
+            if self.compress:
+                self.compress_segment(sealed)
+            # The two newest snapshots are enough to survive a bad write
+            for old in glob.glob(os.path.join(self.directory, "snapshot-*.json")):
+                match = SNAPSHOT_PATTERN.match(os.path.basename(old))
+                if match and int(match.group(1)) < self.segment - 1:
+                    os.remove(old)
+
+    def compress_segment(self, number):
+        path = os.path.join(self.directory, f"segment-{number:06d}.jsonl")
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+
+    def restore(self, game_master):
+        """
+        Rebuilds game_master from the newest snapshot plus the messages logged after it and
+        returns those messages. Returns an empty list for a new save.
+        """
+        snapshot = self.latest_snapshot()
+        first_segment = 1
+        last_seq = -1
+        if snapshot is not None:
+            game_master.set_state(snapshot["game_master"])
+            first_segment = snapshot["segment"]
+            last_seq = snapshot["seq"]
+
+        records = []
+        for number in self.segment_numbers():
+            if number >= first_segment:
+                records += [r for r in self.read_segment(number) if r["seq"] > last_seq]
+        self.segment = max(first_segment, self.segment)
+        self.next_seq = (records[-1]["seq"] if records else last_seq) + 1
+        self.records_in_segment = len(records)
+
+        user_messages = {}
+        last_user_seq = None
+        for record in records:
+            if record["role"] == "user":
+                user_messages[record["seq"]] = record["text"]
+                last_user_seq = record["seq"]
+                continue
+            reply_to = record.get("reply_to")
+            if reply_to is None:
+                reply_to = last_user_seq
+            user_message = user_messages.pop(reply_to, None)
+            if record.get("remembered") and user_message is not None:
+                game_master.memory.add_turn(user_message, record["text"])
+            game_master.state = record["state"]
+            game_master.set_world(record["world_choice"])
+        return records
+
+    def history(self):
+        """
+        Returns every message of the session, oldest first.
+        """
+        records = []
+        for number in self.segment_numbers():
+            records += self.read_segment(number)
+        return records
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
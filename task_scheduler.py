@@ -0,0 +1,157 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+
+
+class CancellationToken:
+    """
+    Lets a running task find out that its result is no longer wanted.
+
+    Tasks can poll cancelled or register callbacks with on_cancel, e.g. to interrupt a
+    generation job on the worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.callbacks = []
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def on_cancel(self, callback):
+        """
+        Calls callback when the token is cancelled, immediately if it already is.
+        """
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancellation callback failed: {e}")
+
+
+class Task:
+    def __init__(self, kind, fn, args, key):
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.key = key
+        self.future = Future()
+        self.token = CancellationToken()
+
+
+class TaskScheduler:
+    """
+    Runs the game client's background work on a fixed-size thread pool.
+
+    Every kind of task ("chat", "portraits", ...) has its own lane in which tasks run
+    one at a time, in submission order, so a burst of clicks can never occupy more than
+    one thread per kind. Submitting a task with the same key as one that is still
+    waiting or running returns the existing future instead of queueing a duplicate.
+    Task functions are called as fn(*args, token=CancellationToken).
+    """
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self.lock = threading.Lock()
+        self.lanes = {}  # kind -> deque of waiting tasks
+        self.running = {}  # kind -> running task
+        self.tasks_by_key = {}
+
+    def submit(self, kind, fn, *args, key=None, supersede=False):
+        """
+        Queues fn(*args, token=...) in the lane for kind and returns its Future.
+
+        key identifies identical work for deduplication. With supersede, every task that
+        is already waiting or running in the lane is cancelled first.
+        """
+        with self.lock:
+            if key is not None and key in self.tasks_by_key:
+                return self.tasks_by_key[key].future
+            if supersede:
+                self.cancel_lane(kind)
+            task = Task(kind, fn, args, key)
+            if key is not None:
+                self.tasks_by_key[key] = task
+            self.lanes.setdefault(kind, deque()).append(task)
+            self.start_next(kind)
+        return task.future
+
+    def cancel(self, kind):
+        """
+        Cancels every waiting and running task of a kind.
+        """
+        with self.lock:
+            self.cancel_lane(kind)
+
+    def cancel_lane(self, kind):
+        """
+        Call with the lock held.
+        """
+        lane = self.lanes.get(kind, ())
+        while lane:
+            task = lane.popleft()
+            task.future.cancel()
+            task.token.cancel()
+            self.forget(task)
+        running = self.running.get(kind)
+        if running is not None:
+            running.token.cancel()
+            self.forget(running)
+
+    def start_next(self, kind):
+        """
+        Starts the next waiting task of a kind if its lane is idle. Call with the lock held.
+        """
+        if kind in self.running:
+            return
+        lane = self.lanes.get(kind)
+        while lane:
+            task = lane.popleft()
+            if task.future.set_running_or_notify_cancel():
+                self.running[kind] = task
+                self.executor.submit(self.run, task)
+                return
+            self.forget(task)
+
+    def run(self, task):
+        try:
+            result = task.fn(*task.args, token=task.token)
+        except BaseException as e:
+            task.future.set_exception(e)
+        else:
+            task.future.set_result(result)
+        finally:
+            with self.lock:
+                del self.running[task.kind]
+                self.forget(task)
+                self.start_next(task.kind)
+
+    def forget(self, task):
+        """
+        Drops a task from the deduplication table. Call with the lock held.
+        """
+        if task.key is not None and self.tasks_by_key.get(task.key) is task:
+            del self.tasks_by_key[task.key]
+
+    def shutdown(self):
+        """
+        Cancels all outstanding work and stops the pool without waiting for running tasks.
+        """
+        with self.lock:
+            for kind in list(self.lanes):
+                self.cancel_lane(kind)
+        self.executor.shutdown(wait=False)